@@ -108,13 +108,48 @@ def verify_decode_jwt(token):
                 'description': 'Unable to find the appropriate key.'
             }, 400)
 
+# Same permission checks as the coffee shop's src/auth/permissions.py, copied
+# since this app runs on its own: a granted scope may use '*' for any segment
+# ('post:*', '*:images'), and requirements are compiled once per route.
+WILDCARD = '*'
+
+def granting_scopes(permission):
+    # 'get:images' -> {'get:images', 'get:*', '*:images', '*:*'}
+    forms = ['']
+    for i, part in enumerate(permission.split(':')):
+        sep = ':' if i else ''
+        forms = [f + sep + p for f in forms for p in (part, WILDCARD)]
+    return frozenset(forms)
+
+class PermissionExpression:
+    def __init__(self, mode, permissions):
+        self.mode = mode
+        self.required = tuple(granting_scopes(p) for p in permissions)
+
+    def allows(self, granted):
+        check = any if self.mode == 'any' else all
+        return check(not scopes.isdisjoint(granted) for scopes in self.required)
+
+def any_of(*permissions):
+    return PermissionExpression('any', permissions)
+
+def all_of(*permissions):
+    return PermissionExpression('all', permissions)
+
+def compile_permissions(permission):
+    if isinstance(permission, PermissionExpression):
+        return permission
+    if isinstance(permission, str):
+        return all_of(permission)
+    return all_of(*permission)
+
 def check_permissions(permission, payload):
     if 'permissions' not in payload:
         raise AuthError({
             'code': 'invalid_claims',
             'description': 'Permissions not incluced in JWT'
         }, 400)
-    if permission not in payload['permissions']:
+    if not compile_permissions(permission).allows(frozenset(payload['permissions'])):
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found'
@@ -122,6 +157,9 @@ def check_permissions(permission, payload):
     return True
 
 def requires_auth(permission=''):
+    # compiled once at decoration time instead of on every request
+    required = compile_permissions(permission)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
@@ -137,7 +175,7 @@ def requires_auth(permission=''):
             }, 401)
                 # abort(401)
             
-            check_permissions(permission, payload)
+            check_permissions(required, payload)
 
             return f(payload, *args, **kwargs)
 
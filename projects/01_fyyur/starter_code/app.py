@@ -3,15 +3,28 @@
 #----------------------------------------------------------------------------#
 
 import json
+import time
+import click
+import base64
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
+from flask_migrate import Migrate
+from sqlalchemy import and_, or_, func, literal_column
 from flask_wtf import Form
 from forms import *
+from search import NameSearch, enable_pg_trgm, trigram_index
+from cache import PageCache
+from cleanup import CascadeDeleter
+from counters import ShowCounters
+from logs import init_logging
+from flask_metrics import Metrics
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -20,15 +33,36 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 db = SQLAlchemy(app)
-
-# TODO: connect to a local postgresql database
+migrate = Migrate(app, db)
+metrics = Metrics(app)
+enable_pg_trgm(db.metadata)
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+# the (genre_id, venue_id) and (genre_id, artist_id) indexes serve ?genre= filters
+venue_genres = db.Table('VenueGenre',
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venuegenre_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+artist_genres = db.Table('ArtistGenre',
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artistgenre_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (trigram_index('ix_venue_name_trgm', 'name'),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -36,38 +70,366 @@ class Venue(db.Model):
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
+    # comma-separated genres from before the Genre table, emptied by `flask convert-genres`
+    legacy_genres = db.Column('genres', db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
+    website = db.Column(db.String(120))
+    seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
+    seeking_description = db.Column(db.String(500))
+    # set while the venue's shows are removed in the background (see cleanup.py)
+    deleted = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
+    shows = db.relationship('Show', backref='venue', lazy=True)
+    genres = db.relationship('Genre', secondary=venue_genres, order_by='Genre.name')
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (trigram_index('ix_artist_name_trgm', 'name'),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    # comma-separated genres from before the Genre table, emptied by `flask convert-genres`
+    legacy_genres = db.Column('genres', db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
+    website = db.Column(db.String(120))
+    seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
+    seeking_description = db.Column(db.String(500))
+    # set while the artist's shows are removed in the background (see cleanup.py)
+    deleted = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    shows = db.relationship('Show', backref='artist', lazy=True)
+    genres = db.relationship('Genre', secondary=artist_genres, order_by='Genre.name')
+
+class Show(db.Model):
+    __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        # the /shows listing order, so each page reads its rows from the index
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    )
 
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
+    id = db.Column(db.Integer, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
 
-# TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+class ShowCount(db.Model):
+    # upcoming/past show counts of a venue or artist, maintained by counters.ShowCounters
+    __tablename__ = 'ShowCount'
+
+    kind = db.Column(db.String(10), primary_key=True)
+    owner_id = db.Column(db.Integer, primary_key=True)
+    upcoming = db.Column(db.Integer, nullable=False)
+    past = db.Column(db.Integer, nullable=False)
+    valid_until = db.Column(db.DateTime, nullable=False)
+    # bumped whenever a show of the owner is written, see counters.py
+    version = db.Column(db.Integer, nullable=False, server_default='0')
+
+# /venues and /artists are listed in these orders, which the indexes below
+# hold so a page is read from the index. '' is inlined rather than bound, as
+# SQLite only uses an expression index for the identical expression.
+EMPTY = literal_column("''")
+
+def venue_listing_order():
+  return [func.coalesce(Venue.state, EMPTY), func.coalesce(Venue.city, EMPTY), func.coalesce(Venue.name, EMPTY), Venue.id]
+
+def artist_listing_order():
+  return [func.coalesce(Artist.name, EMPTY), Artist.id]
+
+db.Index('ix_venue_listing', *venue_listing_order())
+db.Index('ix_artist_listing', *artist_listing_order())
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+# Each page is built from a fixed number of statements: counts come from the
+# ShowCount table and show listings join their artist/venue in the same
+# SELECT, so nothing below runs one query per venue, artist or show.
+
+def split_genres(genres):
+  # 'Jazz,Reggae', '{Jazz,Reggae}' or '["Jazz", "Reggae"]'
+  if not genres:
+    return []
+  names = (g.strip().strip('"\'') for g in genres.strip('{}[]').split(','))
+  return [name for name in names if name]
+
+def genre_names(obj):
+  return [genre.name for genre in obj.genres] or split_genres(obj.legacy_genres)
+
+def genres_named(names):
+  # Genre rows for the given names, creating the missing ones
+  names = list(dict.fromkeys(name for name in names if name))
+  known = {genre.name: genre for genre in Genre.query.filter(Genre.name.in_(names))} if names else {}
+  return [known.get(name) or Genre(name=name) for name in names]
+
+def with_genre(query, model, table, fk, genre):
+  # keeps the rows tagged with the named genre, through the association's genre_id index
+  if not genre:
+    return query
+  return query.join(table, fk == model.id) \
+    .join(Genre, Genre.id == table.c.genre_id) \
+    .filter(Genre.name == genre)
+
+def fill_venue(venue, form):
+  venue.name = form['name']
+  venue.city = form['city']
+  venue.state = form['state']
+  venue.address = form['address']
+  venue.phone = form.get('phone')
+  venue.genres = genres_named(form.getlist('genres'))
+  venue.legacy_genres = None
+  venue.image_link = form.get('image_link')
+  venue.facebook_link = form.get('facebook_link')
+
+def fill_artist(artist, form):
+  artist.name = form['name']
+  artist.city = form['city']
+  artist.state = form['state']
+  artist.phone = form.get('phone')
+  artist.genres = genres_named(form.getlist('genres'))
+  artist.legacy_genres = None
+  artist.image_link = form.get('image_link')
+  artist.facebook_link = form.get('facebook_link')
+
+def get_or_404(model, id):
+  # venues and artists being deleted are already gone as far as pages are concerned
+  obj = model.query.get(id)
+  if obj is None or obj.deleted:
+    abort(404)
+  return obj
+
+def is_live(model, id):
+  return db.session.query(model.id).filter(model.id == id, model.deleted == False).first() is not None
+
+def save(obj=None):
+  # adds obj (if given) and commits; returns False after rolling back on failure
+  try:
+    if obj is not None:
+      db.session.add(obj)
+    db.session.commit()
+    return True
+  except Exception:
+    db.session.rollback()
+    app.logger.exception('could not save %r', obj)
+    return False
+
+show_counters = ShowCounters(db, ShowCount, Show, {
+  'venue': (Venue, Show.venue_id),
+  'artist': (Artist, Show.artist_id),
+})
+
+# Lists are paged with keyset cursors: ?after= carries the sort key of the
+# last row already shown, so a page costs the same however deep it is.
+
+PAGE_SIZE = 50
+SHOWS_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 200
+
+def page_limit(default=PAGE_SIZE):
+  return min(max(request.args.get('limit', default, type=int), 1), MAX_PAGE_SIZE)
+
+def encode_cursor(values):
+  return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, types):
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if len(values) != len(types):
+      raise ValueError(cursor)
+    return [convert(value) for convert, value in zip(types, values)]
+  except (ValueError, TypeError):
+    abort(400)
+
+def keyset_filter(columns, values, descending=False):
+  # (c1, c2, ...) > (v1, v2, ...) spelled out, row values are not portable
+  column, value = columns[0], values[0]
+  beyond = column < value if descending else column > value
+  if len(columns) == 1:
+    return beyond
+  return or_(beyond, and_(column == value, keyset_filter(columns[1:], values[1:], descending)))
+
+def keyset_page(query, columns, types, key, limit, after=None, descending=False):
+  # returns (rows, next_cursor); next_cursor is None on the last page
+  if after:
+    values = decode_cursor(after, types)
+    # the redundant bound on the first column lets the database seek in the index
+    first = columns[0] <= values[0] if descending else columns[0] >= values[0]
+    query = query.filter(first, keyset_filter(columns, values, descending))
+  rows = query.order_by(*[c.desc() if descending else c for c in columns]).limit(limit + 1).all()
+  if len(rows) <= limit:
+    return rows, None
+  rows = rows[:limit]
+  return rows, encode_cursor(key(rows[-1]))
+
+def next_page_url(next_cursor, **kwargs):
+  if next_cursor is None:
+    return None
+  return url_for(request.endpoint, after=next_cursor, limit=request.args.get('limit'), **kwargs)
+
+def shows_page(fk, id, other, when, now, limit, after=None):
+  # upcoming shows soonest first, past shows most recent first, joined with
+  # the artist (on a venue page) or the venue (on an artist page)
+  other_fk = Show.artist_id if other is Artist else Show.venue_id
+  query = db.session.query(Show, other).join(other, other_fk == other.id) \
+    .filter(fk == id, other.deleted == False)
+  if when == 'upcoming':
+    query = query.filter(Show.start_time > now)
+  else:
+    query = query.filter(Show.start_time <= now)
+  return keyset_page(query, [Show.start_time, Show.id], [parse_datetime, int],
+    lambda row: [row.Show.start_time.isoformat(), row.Show.id],
+    limit, after=after, descending=(when == 'past'))
+
+def shows_json(model, fk, id, other, format_show):
+  # unknown and deleted venues or artists are a 404, as on their detail pages
+  if not is_live(model, id):
+    abort(404)
+  when = request.args.get('when', 'upcoming')
+  if when not in ('upcoming', 'past'):
+    abort(400)
+  rows, next_cursor = shows_page(fk, id, other, when, datetime.now(),
+    page_limit(SHOWS_PAGE_SIZE), after=request.args.get('after'))
+  shows = []
+  for row in rows:
+    show = format_show(row)
+    show['start_time'] = row.Show.start_time.isoformat()
+    show['start_time_display'] = format_datetime(row.Show.start_time, 'full')
+    shows.append(show)
+  return jsonify({'shows': shows, 'next_cursor': next_cursor})
+
+venue_search = NameSearch(db, Venue, hidden='deleted')
+artist_search = NameSearch(db, Artist, hidden='deleted')
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+def search_results(model, search):
+  # ranked page of ids from the name index, then one query for their upcoming show counts
+  search_term = request.form.get('search_term', '')
+  limit = min(request.values.get('limit', SEARCH_PAGE_SIZE, type=int), MAX_SEARCH_PAGE_SIZE)
+  offset = max(request.values.get('offset', 0, type=int), 0)
+  ids, count = search.search(search_term, max(limit, 1), offset)
+
+  rows = {}
+  if ids:
+    rows = {row.id: row for row in db.session.query(model.id, model.name)
+      .filter(model.id.in_(ids), model.deleted == False)}
+  counts = show_counters.get(model.__name__.lower(), list(rows), datetime.now())
+  return {
+    "count": count,
+    "data": [{
+      "id": rows[id].id,
+      "name": rows[id].name,
+      "num_upcoming_shows": counts[id][0],
+    } for id in ids if id in rows]
+  }
+
+def venue_show(row):
+  return {
+    "artist_id": row.Artist.id,
+    "artist_name": row.Artist.name,
+    "artist_image_link": row.Artist.image_link,
+    "start_time": row.Show.start_time
+  }
+
+def artist_show(row):
+  return {
+    "venue_id": row.Venue.id,
+    "venue_name": row.Venue.name,
+    "venue_image_link": row.Venue.image_link,
+    "start_time": row.Show.start_time
+  }
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+# list pages are cached until a commit touches the data they show
+page_cache = PageCache(app)
+page_cache.watch({Venue: 'venues', Artist: 'artists', Show: 'shows'})
+
+# (id, name) choices for the show form's pickers, reused until a commit
+# bumps the venues or artists page cache version, and at most
+# NAME_CHOICES_TTL seconds: memory backend versions are per process, so
+# other processes' new venues and artists show up after that
+name_choice_lists = {}
+
+def name_choices(model, data_set):
+  version = page_cache.versions([data_set])[0] if page_cache.backend is not None else None
+  cached = name_choice_lists.get(model)
+  now = time.monotonic()
+  if version is None or cached is None or cached[0] != version or cached[1] <= now:
+    rows = db.session.query(model.id, model.name).filter(model.deleted == False).order_by(model.name, model.id)
+    cached = (version, now + app.config['NAME_CHOICES_TTL'], tuple((id, name or '') for id, name in rows))
+    name_choice_lists[model] = cached
+  return cached[2]
+
+#----------------------------------------------------------------------------#
+# Deletes.
+#----------------------------------------------------------------------------#
+
+# deleting a venue or artist hides it right away; its shows, then the row
+# itself, are removed in batches by a background worker
+deleter = CascadeDeleter(app, db, batch_size=app.config['DELETE_BATCH_SIZE'])
+deleter.register(Venue, Show, Show.venue_id, before_delete=show_counters.forget_shows)
+deleter.register(Artist, Show, Show.artist_id, before_delete=show_counters.forget_shows)
+
+@app.before_request
+def start_deleter():
+  # also resumes deletes left unfinished by a previous process
+  deleter.start()
+
+def soft_delete(model, id, progress_endpoint):
+  obj = get_or_404(model, id)
+  obj.deleted = True
+  if not save():
+    abort(500)
+  deleter.submit(model, obj.id)
+  response = jsonify({'success': True, 'progress_url': url_for(progress_endpoint, **{model.__name__.lower() + '_id': obj.id})})
+  return response, 202
+
+def deletion_progress(model, id):
+  progress = deleter.progress(model, id)
+  if progress is None:
+    abort(404)
+  return jsonify(progress)
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+@lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  # compiled Babel pattern and locale, built once per (format, locale)
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+def parse_datetime(value):
+  if isinstance(value, datetime):
+    return value
+  # strict ISO-8601 first, dateutil only for anything else
+  try:
+    return datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+  except ValueError:
+    return dateutil.parser.parse(value)
+
+@lru_cache(maxsize=4096)
+def format_datetime(value, format='medium', locale=babel.dates.LC_TIME):
+  # formatted in the value's own timezone, as babel.dates.format_datetime does
+  date = parse_datetime(value)
+  pattern, locale = datetime_pattern(format, locale)
+  return pattern.apply(date, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
@@ -84,131 +446,73 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@page_cache.cached('venues', 'shows')
 def venues():
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "city": "San Francisco",
-    "state": "CA",
-    "venues": [{
-      "id": 1,
-      "name": "The Musical Hop",
-      "num_upcoming_shows": 0,
-    }, {
-      "id": 3,
-      "name": "Park Square Live Music & Coffee",
-      "num_upcoming_shows": 1,
-    }]
-  }, {
-    "city": "New York",
-    "state": "NY",
-    "venues": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }]
-  return render_template('pages/venues.html', areas=data);
+  # ?genre= keeps the venues tagged with that genre
+  genre = request.args.get('genre')
+  query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state).filter(Venue.deleted == False)
+  query = with_genre(query, Venue, venue_genres, venue_genres.c.venue_id, genre)
+  rows, next_cursor = keyset_page(query, venue_listing_order(), [str, str, str, int],
+    lambda row: [row.state or '', row.city or '', row.name or '', row.id],
+    page_limit(), after=request.args.get('after'))
+  counts = show_counters.get('venue', [row.id for row in rows], datetime.now())
+  data=[]
+  for (city, state), area in groupby(rows, key=lambda row: (row.city, row.state)):
+    data.append({
+      "city": city,
+      "state": state,
+      "venues": [{
+        "id": row.id,
+        "name": row.name,
+        "num_upcoming_shows": counts[row.id][0],
+      } for row in area]
+    })
+  return render_template('pages/venues.html', areas=data, genre=genre, next_url=next_page_url(next_cursor, genre=genre));
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for Hop should return "The Musical Hop".
-  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  response={
-    "count": 1,
-    "data": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }
+  # case-insensitive partial match on the venue name, best matches first
+  # ?limit= and ?offset= page through the results
+  response = search_results(Venue, venue_search)
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-  data1={
-    "id": 1,
-    "name": "The Musical Hop",
-    "genres": ["Jazz", "Reggae", "Swing", "Classical", "Folk"],
-    "address": "1015 Folsom Street",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "123-123-1234",
-    "website": "https://www.themusicalhop.com",
-    "facebook_link": "https://www.facebook.com/TheMusicalHop",
-    "seeking_talent": True,
-    "seeking_description": "We are on the lookout for a local artist to play every two weeks. Please call us.",
-    "image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60",
-    "past_shows": [{
-      "artist_id": 4,
-      "artist_name": "Guns N Petals",
-      "artist_image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-      "start_time": "2019-05-21T21:30:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
+  venue = get_or_404(Venue, venue_id)
+
+  now = datetime.now()
+  upcoming_shows_count, past_shows_count = show_counters.get('venue', [venue_id], now)[venue_id]
+  upcoming_rows, upcoming_cursor = shows_page(Show.venue_id, venue_id, Artist, 'upcoming', now, SHOWS_PAGE_SIZE)
+  past_rows, past_cursor = shows_page(Show.venue_id, venue_id, Artist, 'past', now, SHOWS_PAGE_SIZE)
+
+  data={
+    "id": venue.id,
+    "name": venue.name,
+    "genres": genre_names(venue),
+    "address": venue.address,
+    "city": venue.city,
+    "state": venue.state,
+    "phone": venue.phone,
+    "website": venue.website,
+    "facebook_link": venue.facebook_link,
+    "seeking_talent": venue.seeking_talent,
+    "seeking_description": venue.seeking_description,
+    "image_link": venue.image_link,
+    "past_shows": [venue_show(row) for row in past_rows],
+    "upcoming_shows": [venue_show(row) for row in upcoming_rows],
+    "past_shows_count": past_shows_count,
+    "upcoming_shows_count": upcoming_shows_count,
+    "past_shows_cursor": past_cursor,
+    "upcoming_shows_cursor": upcoming_cursor,
   }
-  data2={
-    "id": 2,
-    "name": "The Dueling Pianos Bar",
-    "genres": ["Classical", "R&B", "Hip-Hop"],
-    "address": "335 Delancey Street",
-    "city": "New York",
-    "state": "NY",
-    "phone": "914-003-1132",
-    "website": "https://www.theduelingpianos.com",
-    "facebook_link": "https://www.facebook.com/theduelingpianos",
-    "seeking_talent": False,
-    "image_link": "https://images.unsplash.com/photo-1497032205916-ac775f0649ae?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=750&q=80",
-    "past_shows": [],
-    "upcoming_shows": [],
-    "past_shows_count": 0,
-    "upcoming_shows_count": 0,
-  }
-  data3={
-    "id": 3,
-    "name": "Park Square Live Music & Coffee",
-    "genres": ["Rock n Roll", "Jazz", "Classical", "Folk"],
-    "address": "34 Whiskey Moore Ave",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "415-000-1234",
-    "website": "https://www.parksquarelivemusicandcoffee.com",
-    "facebook_link": "https://www.facebook.com/ParkSquareLiveMusicAndCoffee",
-    "seeking_talent": False,
-    "image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-    "past_shows": [{
-      "artist_id": 5,
-      "artist_name": "Matt Quevedo",
-      "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-      "start_time": "2019-06-15T23:00:00.000Z"
-    }],
-    "upcoming_shows": [{
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-01T20:00:00.000Z"
-    }, {
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-08T20:00:00.000Z"
-    }, {
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-15T20:00:00.000Z"
-    }],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 1,
-  }
-  data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
   return render_template('pages/show_venue.html', venue=data)
 
+@app.route('/venues/<int:venue_id>/shows')
+def venue_shows(venue_id):
+  # next page of a venue's ?when=upcoming|past shows for the "load more" button
+  return shows_json(Venue, Show.venue_id, venue_id, Artist, venue_show)
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -219,187 +523,122 @@ def create_venue_form():
 
 @app.route('/venues/create', methods=['POST'])
 def create_venue_submission():
-  # TODO: insert form data as a new Venue record in the db, instead
-  # TODO: modify data to be the data object returned from db insertion
-
-  # on successful db insert, flash success
-  flash('Venue ' + request.form['name'] + ' was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
-  # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
+  venue = Venue()
+  fill_venue(venue, request.form)
+  if save(venue):
+    flash('Venue ' + request.form['name'] + ' was successfully listed!')
+  else:
+    flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
-  # TODO: Complete this endpoint for taking a venue_id, and using
-  # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+  # answers 202 once the venue is hidden; poll progress_url until it is deleted
+  return soft_delete(Venue, venue_id, 'venue_deletion')
 
-  # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
-  # clicking that button delete it from the db then redirect the user to the homepage
-  return None
+@app.route('/venues/<int:venue_id>/deletion')
+def venue_deletion(venue_id):
+  return deletion_progress(Venue, venue_id)
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@page_cache.cached('artists')
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data=[{
-    "id": 4,
-    "name": "Guns N Petals",
-  }, {
-    "id": 5,
-    "name": "Matt Quevedo",
-  }, {
-    "id": 6,
-    "name": "The Wild Sax Band",
-  }]
-  return render_template('pages/artists.html', artists=data)
+  # ?genre= keeps the artists tagged with that genre
+  genre = request.args.get('genre')
+  query = db.session.query(Artist.id, Artist.name).filter(Artist.deleted == False)
+  query = with_genre(query, Artist, artist_genres, artist_genres.c.artist_id, genre)
+  rows, next_cursor = keyset_page(query, artist_listing_order(), [str, int],
+    lambda row: [row.name or '', row.id], page_limit(), after=request.args.get('after'))
+  data = [{
+    "id": row.id,
+    "name": row.name,
+  } for row in rows]
+  return render_template('pages/artists.html', artists=data, genre=genre, next_url=next_page_url(next_cursor, genre=genre))
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-  # search for "band" should return "The Wild Sax Band".
-  response={
-    "count": 1,
-    "data": [{
-      "id": 4,
-      "name": "Guns N Petals",
-      "num_upcoming_shows": 0,
-    }]
-  }
+  # case-insensitive partial match on the artist name, best matches first
+  # ?limit= and ?offset= page through the results
+  response = search_results(Artist, artist_search)
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-  # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-  data1={
-    "id": 4,
-    "name": "Guns N Petals",
-    "genres": ["Rock n Roll"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "326-123-5000",
-    "website": "https://www.gunsnpetalsband.com",
-    "facebook_link": "https://www.facebook.com/GunsNPetals",
-    "seeking_venue": True,
-    "seeking_description": "Looking for shows to perform at in the San Francisco Bay Area!",
-    "image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-    "past_shows": [{
-      "venue_id": 1,
-      "venue_name": "The Musical Hop",
-      "venue_image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60",
-      "start_time": "2019-05-21T21:30:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
-  }
-  data2={
-    "id": 5,
-    "name": "Matt Quevedo",
-    "genres": ["Jazz"],
-    "city": "New York",
-    "state": "NY",
-    "phone": "300-400-5000",
-    "facebook_link": "https://www.facebook.com/mattquevedo923251523",
-    "seeking_venue": False,
-    "image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-    "past_shows": [{
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2019-06-15T23:00:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
+  # shows the artist page with the given artist_id
+  artist = get_or_404(Artist, artist_id)
+
+  now = datetime.now()
+  upcoming_shows_count, past_shows_count = show_counters.get('artist', [artist_id], now)[artist_id]
+  upcoming_rows, upcoming_cursor = shows_page(Show.artist_id, artist_id, Venue, 'upcoming', now, SHOWS_PAGE_SIZE)
+  past_rows, past_cursor = shows_page(Show.artist_id, artist_id, Venue, 'past', now, SHOWS_PAGE_SIZE)
+
+  data={
+    "id": artist.id,
+    "name": artist.name,
+    "genres": genre_names(artist),
+    "city": artist.city,
+    "state": artist.state,
+    "phone": artist.phone,
+    "website": artist.website,
+    "facebook_link": artist.facebook_link,
+    "seeking_venue": artist.seeking_venue,
+    "seeking_description": artist.seeking_description,
+    "image_link": artist.image_link,
+    "past_shows": [artist_show(row) for row in past_rows],
+    "upcoming_shows": [artist_show(row) for row in upcoming_rows],
+    "past_shows_count": past_shows_count,
+    "upcoming_shows_count": upcoming_shows_count,
+    "past_shows_cursor": past_cursor,
+    "upcoming_shows_cursor": upcoming_cursor,
   }
-  data3={
-    "id": 6,
-    "name": "The Wild Sax Band",
-    "genres": ["Jazz", "Classical"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "432-325-5432",
-    "seeking_venue": False,
-    "image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "past_shows": [],
-    "upcoming_shows": [{
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-01T20:00:00.000Z"
-    }, {
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-08T20:00:00.000Z"
-    }, {
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-15T20:00:00.000Z"
-    }],
-    "past_shows_count": 0,
-    "upcoming_shows_count": 3,
-  }
-  data = list(filter(lambda d: d['id'] == artist_id, [data1, data2, data3]))[0]
   return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>/shows')
+def artist_shows(artist_id):
+  # next page of an artist's ?when=upcoming|past shows for the "load more" button
+  return shows_json(Artist, Show.artist_id, artist_id, Venue, artist_show)
+
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+  # answers 202 once the artist is hidden; poll progress_url until it is deleted
+  return soft_delete(Artist, artist_id, 'artist_deletion')
+
+@app.route('/artists/<int:artist_id>/deletion')
+def artist_deletion(artist_id):
+  return deletion_progress(Artist, artist_id)
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-  form = ArtistForm()
-  artist={
-    "id": 4,
-    "name": "Guns N Petals",
-    "genres": ["Rock n Roll"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "326-123-5000",
-    "website": "https://www.gunsnpetalsband.com",
-    "facebook_link": "https://www.facebook.com/GunsNPetals",
-    "seeking_venue": True,
-    "seeking_description": "Looking for shows to perform at in the San Francisco Bay Area!",
-    "image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80"
-  }
-  # TODO: populate form with fields from artist with ID <artist_id>
+  artist = get_or_404(Artist, artist_id)
+  form = ArtistForm(obj=artist)
+  form.genres.data = genre_names(artist)
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
-  # TODO: take values from the form submitted, and update existing
-  # artist record with ID <artist_id> using the new attributes
-
+  artist = get_or_404(Artist, artist_id)
+  fill_artist(artist, request.form)
+  if not save():
+    flash('An error occurred. Artist ' + request.form['name'] + ' could not be updated.')
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  form = VenueForm()
-  venue={
-    "id": 1,
-    "name": "The Musical Hop",
-    "genres": ["Jazz", "Reggae", "Swing", "Classical", "Folk"],
-    "address": "1015 Folsom Street",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "123-123-1234",
-    "website": "https://www.themusicalhop.com",
-    "facebook_link": "https://www.facebook.com/TheMusicalHop",
-    "seeking_talent": True,
-    "seeking_description": "We are on the lookout for a local artist to play every two weeks. Please call us.",
-    "image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60"
-  }
-  # TODO: populate form with values from venue with ID <venue_id>
+  venue = get_or_404(Venue, venue_id)
+  form = VenueForm(obj=venue)
+  form.genres.data = genre_names(venue)
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-  # TODO: take values from the form submitted, and update existing
-  # venue record with ID <venue_id> using the new attributes
+  venue = get_or_404(Venue, venue_id)
+  fill_venue(venue, request.form)
+  if not save():
+    flash('An error occurred. Venue ' + request.form['name'] + ' could not be updated.')
   return redirect(url_for('show_venue', venue_id=venue_id))
 
 #  Create Artist
@@ -413,13 +652,12 @@ def create_artist_form():
 @app.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
-  # TODO: insert form data as a new Venue record in the db, instead
-  # TODO: modify data to be the data object returned from db insertion
-
-  # on successful db insert, flash success
-  flash('Artist ' + request.form['name'] + ' was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Artist ' + data.name + ' could not be listed.')
+  artist = Artist()
+  fill_artist(artist, request.form)
+  if save(artist):
+    flash('Artist ' + request.form['name'] + ' was successfully listed!')
+  else:
+    flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
   return render_template('pages/home.html')
 
 
@@ -427,64 +665,44 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@page_cache.cached('shows', 'venues', 'artists')
 def shows():
   # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "venue_id": 1,
-    "venue_name": "The Musical Hop",
-    "artist_id": 4,
-    "artist_name": "Guns N Petals",
-    "artist_image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-    "start_time": "2019-05-21T21:30:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 5,
-    "artist_name": "Matt Quevedo",
-    "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-    "start_time": "2019-06-15T23:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-01T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-08T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-15T20:00:00.000Z"
-  }]
-  return render_template('pages/shows.html', shows=data)
+  query = db.session.query(Show, Venue, Artist) \
+    .join(Venue, Show.venue_id == Venue.id) \
+    .join(Artist, Show.artist_id == Artist.id) \
+    .filter(Venue.deleted == False, Artist.deleted == False)
+  rows, next_cursor = keyset_page(query, [Show.start_time, Show.id], [parse_datetime, int],
+    lambda row: [row.Show.start_time.isoformat(), row.Show.id], page_limit(), after=request.args.get('after'))
+  data = [dict(artist_show(row), **venue_show(row)) for row in rows]
+  return render_template('pages/shows.html', shows=data, next_url=next_page_url(next_cursor))
 
 @app.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
+  form.artist_id.choices = name_choices(Artist, 'artists')
+  form.venue_id.choices = name_choices(Venue, 'venues')
   return render_template('forms/new_show.html', form=form)
 
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
-  # TODO: insert form data as a new Show record in the db, instead
-
-  # on successful db insert, flash success
-  flash('Show was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Show could not be listed.')
-  # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
+  try:
+    show = Show(
+      artist_id=int(request.form['artist_id']),
+      venue_id=int(request.form['venue_id']),
+      start_time=dateutil.parser.parse(request.form['start_time'])
+    )
+  except (KeyError, ValueError, OverflowError):
+    show = None
+  if show is not None and not (is_live(Venue, show.venue_id) and is_live(Artist, show.artist_id)):
+    # no new shows for venues or artists that are being deleted
+    show = None
+  if show is not None and save(show):
+    flash('Show was successfully listed!')
+  else:
+    flash('An error occurred. Show could not be listed.')
   return render_template('pages/home.html')
 
 @app.errorhandler(404)
@@ -496,15 +714,43 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+init_logging(app)
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+GENRE_BATCH_SIZE = 1000
+
+@app.cli.command('convert-genres')
+def convert_genres():
+  '''Moves the comma-separated genres of venues and artists into the Genre tables.'''
+  for model, table, fk in ((Venue, venue_genres, 'venue_id'), (Artist, artist_genres, 'artist_id')):
+    converted = 0
+    while True:
+      rows = db.session.query(model.id, model.legacy_genres) \
+        .filter(model.legacy_genres != None) \
+        .order_by(model.id).limit(GENRE_BATCH_SIZE).all()
+      if not rows:
+        break
+      names = {row.id: set(split_genres(row.legacy_genres)) for row in rows}
+      wanted = set().union(*names.values())
+      known = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(wanted))) if wanted else {}
+      missing = [{'name': name} for name in wanted if name not in known]
+      if missing:
+        db.session.execute(Genre.__table__.insert(), missing)
+        known.update(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_([m['name'] for m in missing])))
+
+      ids = [row.id for row in rows]
+      linked = set(db.session.query(table.c[fk], table.c.genre_id).filter(table.c[fk].in_(ids)))
+      links = [{fk: id, 'genre_id': known[name]} for id in ids for name in names[id] if (id, known[name]) not in linked]
+      if links:
+        db.session.execute(table.insert(), links)
+      db.session.query(model).filter(model.id.in_(ids)) \
+        .update({model.legacy_genres: None}, synchronize_session=False)
+      db.session.commit()
+      converted += len(rows)
+    click.echo('{}: {} rows converted'.format(model.__tablename__, converted))
 
 #----------------------------------------------------------------------------#
 # Launch.
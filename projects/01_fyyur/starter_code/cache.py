@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from flask import request, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+# Rendered list pages are cached per URL together with the data versions they
+# were built from. A page declares which data sets it depends on
+# (ex: @page_cache.cached('shows', 'venues', 'artists')); committing a change
+# to a watched model bumps that data set's version, so every page depending
+# on it misses on its next request. Versions live in the backend itself,
+# so with the file backend every process on the host sees the same versions.
+#
+# Pages are keyed on the path and the query arguments the views read (PAGE_ARGS),
+# so made-up arguments share the entry of the page they render.
+
+PAGE_ARGS = ('limit', 'after', 'genre')
+
+class MemoryBackend:
+  '''In-process LRU of at most maxsize values.'''
+
+  def __init__(self, maxsize=512):
+    self.maxsize = maxsize
+    self._values = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      value = self._values.get(key)
+      if value is not None:
+        self._values.move_to_end(key)
+      return value
+
+  def set(self, key, value):
+    with self._lock:
+      self._values[key] = value
+      self._values.move_to_end(key)
+      while len(self._values) > self.maxsize:
+        self._values.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._values.clear()
+
+class FileBackend:
+  '''
+  One json file per key in directory, replaced atomically on write.
+  Past maxsize page files, the least recently written are removed; the
+  check runs every prune_every writes. Version keys are never removed.
+  '''
+
+  def __init__(self, directory, maxsize=2048, prune_every=64):
+    self.directory = directory
+    self.maxsize = maxsize
+    self.prune_every = prune_every
+    self._writes = 0
+    os.makedirs(directory, exist_ok=True)
+
+  def _path(self, key):
+    prefix = 'version-' if key.startswith('version:') else 'page-'
+    return os.path.join(self.directory, prefix + hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+  def get(self, key):
+    try:
+      with open(self._path(key)) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def set(self, key, value):
+    fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+    with os.fdopen(fd, 'w') as f:
+      json.dump(value, f)
+    os.replace(tmp_path, self._path(key))
+    self._writes += 1
+    if self._writes % self.prune_every == 0:
+      self.prune()
+
+  def prune(self):
+    pages = []
+    for entry in os.scandir(self.directory):
+      if entry.name.startswith('page-'):
+        try:
+          pages.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+          pass
+    if len(pages) <= self.maxsize:
+      return
+    pages.sort()
+    for mtime, path in pages[:len(pages) - self.maxsize]:
+      try:
+        os.remove(path)
+      except OSError:
+        # removed by another process meanwhile
+        pass
+
+  def clear(self):
+    for name in os.listdir(self.directory):
+      if name.endswith('.json'):
+        os.remove(os.path.join(self.directory, name))
+
+class PageCache:
+  '''
+  Configured from the app:
+    PAGE_CACHE      'memory', 'file' or None to disable
+    PAGE_CACHE_DIR  directory of the file backend
+    PAGE_CACHE_SIZE pages kept by the memory or file backend
+    PAGE_CACHE_TTL  seconds a page is served before it is rendered again,
+                    which also bounds how stale time-dependent data can get
+  '''
+
+  def __init__(self, app=None):
+    self.backend = None
+    self.ttl = 300
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    kind = app.config.get('PAGE_CACHE', 'memory')
+    self.ttl = app.config.get('PAGE_CACHE_TTL', 300)
+    if kind == 'memory':
+      self.backend = MemoryBackend(app.config.get('PAGE_CACHE_SIZE', 512))
+    elif kind == 'file':
+      self.backend = FileBackend(app.config['PAGE_CACHE_DIR'], app.config.get('PAGE_CACHE_SIZE', 2048))
+    else:
+      self.backend = None
+
+  def versions(self, names):
+    return [self.backend.get('version:' + name) or '0' for name in names]
+
+  def bump(self, *names):
+    if self.backend is None:
+      return
+    for name in names:
+      self.backend.set('version:' + name, uuid.uuid4().hex)
+
+  def get(self, key, versions):
+    entry = self.backend.get('page:' + key)
+    if entry is None or entry['versions'] != versions or entry['expires_at'] <= time.time():
+      return None
+    return entry['body']
+
+  def set(self, key, versions, body):
+    self.backend.set('page:' + key, {
+      'versions': versions,
+      'expires_at': time.time() + self.ttl,
+      'body': body,
+    })
+
+  def cached(self, *names, params=PAGE_ARGS):
+    '''
+    Caches the rendered body of a GET view that depends on the named data sets,
+    keyed on the path and the given query arguments.
+    '''
+    def decorator(f):
+      @wraps(f)
+      def wrapper(*args, **kwargs):
+        # pages carrying flashed messages are specific to one visitor
+        if self.backend is None or '_flashes' in session:
+          return f(*args, **kwargs)
+        key = request.path + '?' + urlencode([(name, request.args[name]) for name in params if name in request.args])
+        versions = self.versions(names)
+        body = self.get(key, versions)
+        if body is None:
+          body = f(*args, **kwargs)
+          if isinstance(body, str):
+            self.set(key, versions, body)
+        return body
+      return wrapper
+    return decorator
+
+  def watch(self, models):
+    '''
+    Bumps data set versions when rows of the given models are committed.
+    models maps a model class to the data set name it belongs to.
+    '''
+    def changed(session):
+      return session.info.setdefault('page_cache_changed', set())
+
+    @event.listens_for(Session, 'after_flush')
+    def after_flush(session, flush_context):
+      for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        name = models.get(type(obj))
+        if name is not None:
+          changed(session).add(name)
+
+    def after_bulk(context):
+      name = models.get(context.mapper.class_)
+      if name is not None:
+        changed(context.session).add(name)
+    event.listen(Session, 'after_bulk_update', after_bulk)
+    event.listen(Session, 'after_bulk_delete', after_bulk)
+
+    @event.listens_for(Session, 'after_commit')
+    def after_commit(session):
+      names = session.info.pop('page_cache_changed', None)
+      if names:
+        self.bump(*names)
+
+    @event.listens_for(Session, 'after_soft_rollback')
+    def after_soft_rollback(session, previous_transaction):
+      session.info.pop('page_cache_changed', None)
@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+#----------------------------------------------------------------------------#
+# Cascade deletes.
+#----------------------------------------------------------------------------#
+
+# Deleting a venue or artist only flips its `deleted` flag on the request
+# thread. A background worker then removes the dependent rows in batches of
+# batch_size, committing after each batch so no transaction holds locks for
+# long, and finally removes the row itself. Rows still flagged when the
+# worker starts (ex: after a restart) are picked up again.
+#
+# The ids of the last `remembered` rows removed are kept so progress() can
+# tell them from ids that never existed. Only this process's removals are
+# known: a row removed by another process, or before a restart, looks unknown.
+
+class CascadeDeleter:
+
+  def __init__(self, app, db, batch_size=500, pause=0.05, retries=3, remembered=10000):
+    self.app = app
+    self.db = db
+    self.batch_size = batch_size
+    self.pause = pause
+    self.retries = retries
+    self.remembered = remembered
+    self.children = {}
+    self._removed = OrderedDict()
+    self._queue = queue.Queue()
+    self._thread = None
+    self._lock = threading.Lock()
+
+  def register(self, model, child, fk, before_delete=None):
+    '''
+    Rows of child pointing at model through fk are removed before model's row.
+    before_delete(session, ids) runs ahead of each batch, in its transaction.
+    '''
+    self.children[model] = (child, fk, before_delete)
+
+  def start(self):
+    # idempotent, cheap enough to call from before_request
+    if self._thread is not None:
+      return
+    with self._lock:
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+  def submit(self, model, id):
+    self.start()
+    self._queue.put((model, id, 0))
+
+  def progress(self, model, id):
+    '''
+    'active' if the row is not deleted, 'deleting' while dependent rows remain
+    or the row itself is still there, 'deleted' once this process removed it.
+    None for a row that is not there and was not removed by this process.
+    '''
+    child, fk, before_delete = self.children[model]
+    row = self.db.session.query(model.deleted).filter(model.id == id).first()
+    if row is None:
+      with self._lock:
+        removed = (model, id) in self._removed
+      return {'id': id, 'status': 'deleted', 'remaining': 0} if removed else None
+    if not row.deleted:
+      return {'id': id, 'status': 'active', 'remaining': 0}
+    remaining = self.db.session.query(child.id).filter(fk == id).count()
+    return {'id': id, 'status': 'deleting', 'remaining': remaining}
+
+  def _run(self):
+    with self.app.app_context():
+      try:
+        for model in self.children:
+          for (id,) in self.db.session.query(model.id).filter(model.deleted == True):
+            self._queue.put((model, id, 0))
+      except Exception:
+        self.app.logger.exception('could not resume pending deletions')
+      finally:
+        self.db.session.remove()
+
+    while True:
+      model, id, attempt = self._queue.get()
+      with self.app.app_context():
+        try:
+          self._delete(model, id)
+        except Exception:
+          self.db.session.rollback()
+          self.app.logger.exception('could not delete %s %s', model.__name__, id)
+          if attempt + 1 < self.retries:
+            time.sleep(self.pause)
+            self._queue.put((model, id, attempt + 1))
+        finally:
+          self.db.session.remove()
+
+  def _delete(self, model, id):
+    session = self.db.session
+    child, fk, before_delete = self.children[model]
+    while True:
+      ids = [child_id for (child_id,) in session.query(child.id).filter(fk == id).limit(self.batch_size)]
+      if not ids:
+        break
+      if before_delete is not None:
+        before_delete(session, ids)
+      session.query(child).filter(child.id.in_(ids)).delete(synchronize_session=False)
+      session.commit()
+      time.sleep(self.pause)
+    # through the session so relationships (ex: genre links) and listeners see the delete
+    obj = session.query(model).filter(model.id == id, model.deleted == True).first()
+    if obj is not None:
+      session.delete(obj)
+    session.commit()
+    if obj is not None:
+      self._remember(model, id)
+
+  def _remember(self, model, id):
+    with self._lock:
+      self._removed[(model, id)] = True
+      while len(self._removed) > self.remembered:
+        self._removed.popitem(last=False)
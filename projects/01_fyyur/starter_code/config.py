@@ -7,7 +7,25 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 DEBUG = True
 
 # Connect to the database
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://localhost:5432/fyyur')
+SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Rendered list pages: 'memory', 'file' (shared by every process on the host) or None
+PAGE_CACHE = os.environ.get('PAGE_CACHE', 'memory') or None
+PAGE_CACHE_DIR = os.path.join(basedir, '.page_cache')
+PAGE_CACHE_TTL = 300
+# Pages kept at most; past that the least recently rendered are dropped
+PAGE_CACHE_SIZE = 2048
+# Seconds the show form's artist and venue pickers are reused at most
+NAME_CHOICES_TTL = 60
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = '<Put your local database url>'
+# Shows removed per transaction when a venue or artist is deleted
+DELETE_BATCH_SIZE = 500
+
+# Logs: error.log (when not in debug mode) and requests.log, one JSON record per line
+LOG_DIR = basedir
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Share of requests written to requests.log; errors and slow requests are always written
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', '1.0'))
+REQUEST_LOG_SLOW_MS = 500
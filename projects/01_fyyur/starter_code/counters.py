@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, bindparam, case, event, func, inspect, or_, select
+from sqlalchemy.exc import DBAPIError
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+# Upcoming/past show counts per venue and per artist are kept in a counter
+# table instead of being counted over the shows table on every page.
+#
+# A counter row is valid until the earliest of its upcoming shows starts
+# (that show then becomes a past one) and at most max_age seconds. Writing,
+# moving or deleting a show expires the counter rows of its venue and artist
+# in the same flush and bumps their version. Expired rows are counted again
+# on read, for the requested ids only, from the (venue_id, start_time) /
+# (artist_id, start_time) indexes of the shows table.
+#
+# A recount reads the versions first and only stores counts over rows whose
+# version did not change since, so a show committed while it counted (whose
+# counts it may have missed) leaves the row expired instead of stale. Rows are
+# created expired before the first count of an owner for the same reason.
+
+EXPIRED = datetime(1970, 1, 1)
+
+class ShowCounters:
+  '''
+  owners maps a kind to its model and the show column pointing at it,
+  ex: {'venue': (Venue, Show.venue_id), 'artist': (Artist, Show.artist_id)}.
+  get() returns {id: (upcoming, past)} for the given ids of one kind.
+  '''
+
+  def __init__(self, db, counter, show, owners, max_age=3600):
+    self.db = db
+    self.counter = counter
+    self.show = show
+    self.owners = owners
+    self.max_age = max_age
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+      event.listen(show, name, self._on_show_write)
+    for kind, (model, fk) in owners.items():
+      # sqlite may hand out the id of a deleted row again
+      event.listen(model, 'after_insert',
+        lambda mapper, connection, target, kind=kind: self._forget(connection, {(kind, target.id)}))
+
+  def get(self, kind, ids, now):
+    ids = list(ids)
+    if not ids:
+      return {}
+    c = self.counter
+    rows = self.db.session.query(c.owner_id, c.upcoming, c.past, c.valid_until) \
+      .filter(c.kind == kind, c.owner_id.in_(ids))
+    counts = {}
+    stored = set()
+    for row in rows:
+      stored.add(row.owner_id)
+      if row.valid_until > now:
+        counts[row.owner_id] = (row.upcoming, row.past)
+    missing = [id for id in ids if id not in counts]
+    if missing:
+      self._create(kind, [id for id in missing if id not in stored])
+      counts.update(self._recount(kind, missing, now))
+    return counts
+
+  def forget_shows(self, session, ids):
+    '''Expires the counters of the given shows' owners, for changes made outside the ORM (ex: bulk deletes).'''
+    table = self.counter.__table__
+    session.execute(self._expire(or_(*[
+      and_(table.c.kind == kind, table.c.owner_id.in_(session.query(fk).filter(self.show.id.in_(ids))))
+      for kind, (model, fk) in self.owners.items()
+    ])))
+
+  def _create(self, kind, ids):
+    # expired rows, so that shows written from now on bump their version
+    table = self.counter.__table__
+    rows = [{'kind': kind, 'owner_id': id, 'upcoming': 0, 'past': 0, 'valid_until': EXPIRED, 'version': 0}
+      for id in ids]
+    if not rows:
+      return
+    try:
+      with self.db.engine.begin() as connection:
+        connection.execute(table.insert(), rows)
+      return
+    except DBAPIError:
+      # another request created some of them: the others one at a time
+      pass
+    for row in rows:
+      try:
+        with self.db.engine.begin() as connection:
+          connection.execute(table.insert(), row)
+      except DBAPIError:
+        pass
+
+  def _recount(self, kind, ids, now):
+    model, fk = self.owners[kind]
+    show = self.show
+    table = self.counter.__table__
+    with self.db.engine.connect() as connection:
+      versions = {id: version for id, version in connection.execute(select([table.c.owner_id, table.c.version])
+        .where(and_(table.c.kind == kind, table.c.owner_id.in_(ids))))}
+    upcoming = func.count(case([(show.start_time > now, show.id)]))
+    past = func.count(case([(show.start_time <= now, show.id)]))
+    next_start = func.min(case([(show.start_time > now, show.start_time)]))
+    found = {row[0]: row[1:] for row in self.db.session.query(fk, upcoming, past, next_start)
+      .filter(fk.in_(ids)).group_by(fk)}
+
+    expires = now + timedelta(seconds=self.max_age)
+    counts = {}
+    values = []
+    for id in ids:
+      upcoming, past, next_start = found.get(id, (0, 0, None))
+      counts[id] = (upcoming, past)
+      if id in versions:
+        values.append({
+          'b_kind': kind,
+          'b_owner_id': id,
+          'b_version': versions[id],
+          'upcoming': upcoming,
+          'past': past,
+          'valid_until': min(next_start, expires) if next_start else expires,
+        })
+    self._store(values)
+    return counts
+
+  def _store(self, values):
+    # outside the request's session so a GET never commits it; a row whose
+    # version moved on since the recount read it stays expired
+    if not values:
+      return
+    table = self.counter.__table__
+    try:
+      with self.db.engine.begin() as connection:
+        connection.execute(table.update().where(and_(
+          table.c.kind == bindparam('b_kind'),
+          table.c.owner_id == bindparam('b_owner_id'),
+          table.c.version == bindparam('b_version'),
+        )), values)
+    except DBAPIError:
+      # they are counted again next time
+      pass
+
+  def _on_show_write(self, mapper, connection, target):
+    state = inspect(target)
+    keys = set()
+    for kind, (model, fk) in self.owners.items():
+      keys.add((kind, getattr(target, fk.key)))
+      keys.update((kind, id) for id in state.attrs[fk.key].history.deleted)
+    self._forget(connection, keys)
+
+  def _expire(self, condition):
+    table = self.counter.__table__
+    return table.update().where(condition).values(valid_until=EXPIRED, version=table.c.version + 1)
+
+  def _forget(self, connection, keys):
+    table = self.counter.__table__
+    conditions = [and_(table.c.kind == kind, table.c.owner_id == id) for kind, id in keys if id is not None]
+    if conditions:
+      connection.execute(self._expire(or_(*conditions)))
@@ -0,0 +1,119 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, request
+from flask_metrics import request_sql_stats
+
+#----------------------------------------------------------------------------#
+# Logging.
+#----------------------------------------------------------------------------#
+
+# Request threads only put records on a queue; a QueueListener thread
+# formats them as one JSON object per line and writes them to rotating files,
+# so a slow disk never shows up in response times.
+#
+# error.log gets the app logger (warnings and errors when not in debug mode),
+# requests.log one record per sampled request with its route, status,
+# latency and the time spent in the database, as timed by flask_metrics.
+
+# attributes every LogRecord has; anything else was passed through extra=
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+
+  def format(self, record):
+    entry = {
+      'time': self.formatTime(record),
+      'level': record.levelname,
+      'logger': record.name,
+      'message': record.getMessage(),
+    }
+    for key, value in vars(record).items():
+      if key not in RECORD_ATTRIBUTES:
+        entry[key] = value
+    if record.exc_info:
+      entry['exception'] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+def rotating_handler(app, filename, level):
+  handler = RotatingFileHandler(
+    os.path.join(app.config.get('LOG_DIR', '.'), filename),
+    maxBytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+    backupCount=app.config.get('LOG_BACKUP_COUNT', 5)
+  )
+  handler.setLevel(level)
+  handler.setFormatter(JsonFormatter())
+  return handler
+
+class QueueToListener(QueueHandler):
+  # QueueHandler.prepare flattens the record into a preformatted string;
+  # the listener's JsonFormatter wants its fields and exc_info instead
+  def prepare(self, record):
+    record.message = record.getMessage()
+    return record
+
+def init_logging(app):
+  '''
+  Configured from the app:
+    LOG_DIR                  directory of error.log and requests.log
+    LOG_MAX_BYTES            size at which a log file is rotated
+    LOG_BACKUP_COUNT         rotated files kept
+    REQUEST_LOG_SAMPLE_RATE  share of requests logged (0 to 1), errors and
+                             slow requests are always logged
+    REQUEST_LOG_SLOW_MS      latency from which a request counts as slow
+  '''
+  records = queue.Queue(-1)
+  request_logger = logging.getLogger(app.import_name + '.requests')
+  request_logger.setLevel(logging.INFO)
+  request_logger.propagate = False
+  request_logger.addHandler(QueueToListener(records))
+
+  # both loggers share the queue; each file keeps its own logger's records
+  request_handler = rotating_handler(app, 'requests.log', logging.INFO)
+  request_handler.addFilter(lambda record: record.name == request_logger.name)
+  handlers = [request_handler]
+  if not app.debug:
+    error_handler = rotating_handler(app, 'error.log', logging.INFO)
+    error_handler.addFilter(lambda record: record.name != request_logger.name)
+    handlers.append(error_handler)
+    app.logger.setLevel(logging.INFO)
+    app.logger.addHandler(QueueToListener(records))
+
+  listener = QueueListener(records, *handlers, respect_handler_level=True)
+  listener.start()
+  atexit.register(listener.stop)
+
+  sample_rate = app.config.get('REQUEST_LOG_SAMPLE_RATE', 1.0)
+  slow_ms = app.config.get('REQUEST_LOG_SLOW_MS', 500)
+
+  @app.before_request
+  def start_timer():
+    g.request_started = time.perf_counter()
+
+  @app.after_request
+  def log_request(response):
+    started = g.get('request_started')
+    if started is None:
+      return response
+    latency_ms = (time.perf_counter() - started) * 1000
+    if response.status_code < 500 and latency_ms < slow_ms and random.random() >= sample_rate:
+      return response
+    sql = request_sql_stats()
+    request_logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+      'route': request.url_rule.rule if request.url_rule else None,
+      'endpoint': request.endpoint,
+      'method': request.method,
+      'path': request.path,
+      'status': response.status_code,
+      'latency_ms': round(latency_ms, 2),
+      'db_ms': round(sql.seconds * 1000, 2),
+      'db_queries': sql.queries,
+    })
+    return response
+
+  return listener
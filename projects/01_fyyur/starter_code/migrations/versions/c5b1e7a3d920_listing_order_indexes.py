@@ -0,0 +1,30 @@
+"""listing order indexes
+
+Revision ID: c5b1e7a3d920
+Revises: 8f4e2d6a1c05
+Create Date: 2026-10-18 14:05:52.306117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5b1e7a3d920'
+down_revision = '8f4e2d6a1c05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_venue_listing', 'Venue',
+        [sa.text("coalesce(state, '')"), sa.text("coalesce(city, '')"), sa.text("coalesce(name, '')"), 'id'],
+        unique=False)
+    op.create_index('ix_artist_listing', 'Artist', [sa.text("coalesce(name, '')"), 'id'], unique=False)
+    op.create_index('ix_show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_show_start_time_id', table_name='Show')
+    op.drop_index('ix_artist_listing', table_name='Artist')
+    op.drop_index('ix_venue_listing', table_name='Venue')
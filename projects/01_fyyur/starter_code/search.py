@@ -0,0 +1,235 @@
+import heapq
+import threading
+import time
+from flask import current_app
+from sqlalchemy import DDL, Index, event, func, inspect
+from sqlalchemy.orm import Session
+
+#----------------------------------------------------------------------------#
+# Name search.
+#----------------------------------------------------------------------------#
+
+# Case-insensitive partial-name search for venues and artists.
+#
+# On Postgres with the pg_trgm extension the ILIKE filter is answered from a
+# GIN trigram index on the name column (see trigram_index) and ranked with
+# similarity(). Anywhere else (SQLite, Postgres without pg_trgm) an in-process
+# trigram inverted index narrows the candidates instead of a table scan.
+
+def trigrams(text):
+  return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def rank(name, term):
+  # exact match, then prefix, then start of a word, then anywhere; shorter names first
+  if name == term:
+    position = 0
+  elif name.startswith(term):
+    position = 1
+  elif (' ' + term) in name:
+    position = 2
+  else:
+    position = 3
+  return (position, len(name), name)
+
+class NgramIndex:
+  '''Trigram inverted index over lower-cased names, keyed by row id.'''
+
+  def __init__(self):
+    self.names = {}
+    self.postings = {}
+
+  def add(self, id, name):
+    self.remove(id)
+    name = (name or '').lower()
+    self.names[id] = name
+    for gram in trigrams(name):
+      self.postings.setdefault(gram, set()).add(id)
+
+  def remove(self, id):
+    name = self.names.pop(id, None)
+    if name is None:
+      return
+    for gram in trigrams(name):
+      ids = self.postings.get(gram)
+      if ids is not None:
+        ids.discard(id)
+        if not ids:
+          del self.postings[gram]
+
+  def search(self, term, limit, offset):
+    term = term.lower()
+    grams = trigrams(term)
+    if grams:
+      # rarest trigram first keeps the intersection small
+      postings = sorted((self.postings.get(g, ()) for g in grams), key=len)
+      candidates = set(postings[0]).intersection(*postings[1:])
+    else:
+      # terms shorter than a trigram are checked against every name
+      candidates = self.names
+    matches = [id for id in candidates if term in self.names[id]]
+    ranked = heapq.nsmallest(offset + limit, matches, key=lambda id: rank(self.names[id], term))
+    return ranked[offset:], len(matches)
+
+def trigram_index(name, column):
+  '''GIN trigram index on the named column for Postgres; a plain index elsewhere.'''
+  return Index(name, column, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+def enable_pg_trgm(metadata):
+  '''Creates the pg_trgm extension ahead of the tables on Postgres.'''
+  event.listen(metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+class NameSearch:
+  '''
+  Ranked partial-name search over model.name.
+  search() returns (ids, total) for one page of results, best match first.
+  The in-process index is built in a background thread, kept current through
+  ORM events and rebuilt the same way once it is older than max_age seconds,
+  so writes made by other processes show up eventually; searches use the
+  current index meanwhile, or an ILIKE query before the first build is done.
+  Rows written by a session that rolls back are read again on the next search.
+  Rows whose boolean `hidden` column is set (ex: 'deleted') are left out.
+  '''
+
+  def __init__(self, db, model, max_age=300, hidden=None):
+    self.db = db
+    self.model = model
+    self.max_age = max_age
+    self.hidden = hidden
+    self._use_pg_trgm = None
+    self._index = None
+    self._built_at = None
+    self._building = False
+    self._writes = 0
+    self._dirty = set()
+    self._lock = threading.RLock()
+
+    event.listen(model, 'after_insert', self._on_write)
+    event.listen(model, 'after_update', self._on_write)
+    event.listen(model, 'after_delete', self._on_delete)
+    event.listen(Session, 'after_commit', self._on_commit)
+    event.listen(Session, 'after_soft_rollback', self._on_rollback)
+
+  def search(self, term, limit, offset=0):
+    term = term.strip()
+    if self.use_pg_trgm():
+      return self._search_pg_trgm(term, limit, offset)
+    self._refresh_dirty()
+    with self._lock:
+      index = self._current(current_app._get_current_object())
+      if index is not None:
+        return index.search(term, limit, offset)
+    return self._search_like(term, limit, offset)
+
+  def use_pg_trgm(self):
+    if self._use_pg_trgm is None:
+      engine = self.db.engine
+      self._use_pg_trgm = engine.dialect.name == 'postgresql' and engine.execute(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar() is not None
+    return self._use_pg_trgm
+
+  def _visible(self, query):
+    if self.hidden is None:
+      return query
+    return query.filter(getattr(self.model, self.hidden) == False)
+
+  def _matching(self, term):
+    model = self.model
+    pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return self._visible(self.db.session.query(model.id).filter(model.name.ilike(pattern, escape='\\')))
+
+  def _search_pg_trgm(self, term, limit, offset):
+    model = self.model
+    query = self._matching(term)
+    total = query.count()
+    ids = [id for (id,) in query
+      .order_by(func.similarity(model.name, term).desc(), model.name)
+      .limit(limit).offset(offset)]
+    return ids, total
+
+  def _search_like(self, term, limit, offset):
+    # table scan, only until the first index build is done
+    model = self.model
+    query = self._matching(term)
+    total = query.count()
+    ids = [id for (id,) in query.order_by(func.length(model.name), model.name).limit(limit).offset(offset)]
+    return ids, total
+
+  def _current(self, app):
+    # the index to search, None before the first build; starts a build when due
+    stale = self._built_at is None or time.monotonic() - self._built_at > self.max_age
+    if self._index is None or stale:
+      self._build_in_background(app)
+    return self._index
+
+  def _build_in_background(self, app):
+    if self._building:
+      return
+    self._building = True
+    writes = self._writes
+
+    def build():
+      try:
+        with app.app_context():
+          try:
+            index = NgramIndex()
+            for id, name in self._visible(self.db.session.query(self.model.id, self.model.name)):
+              index.add(id, name)
+          finally:
+            self.db.session.remove()
+        with self._lock:
+          self._index = index
+          # a write may have landed after the rows were read: build again next time
+          self._built_at = time.monotonic() if self._writes == writes else None
+      finally:
+        self._building = False
+
+    threading.Thread(target=build, daemon=True).start()
+
+  def _refresh_dirty(self):
+    # rows written by a rolled back session: reread them, not the whole table
+    with self._lock:
+      ids, self._dirty = self._dirty, set()
+    if not ids or self._index is None:
+      return
+    model = self.model
+    rows = dict(self._visible(self.db.session.query(model.id, model.name)).filter(model.id.in_(ids)))
+    with self._lock:
+      if self._index is not None:
+        for id in ids:
+          if id in rows:
+            self._index.add(id, rows[id])
+          else:
+            self._index.remove(id)
+
+  def _track(self, target):
+    session = inspect(target).session
+    if session is not None:
+      session.info.setdefault(self, set()).add(target.id)
+
+  def _on_write(self, mapper, connection, target):
+    self._track(target)
+    with self._lock:
+      self._writes += 1
+      if self._index is None:
+        return
+      if self.hidden is not None and getattr(target, self.hidden):
+        self._index.remove(target.id)
+      else:
+        self._index.add(target.id, target.name)
+
+  def _on_delete(self, mapper, connection, target):
+    self._track(target)
+    with self._lock:
+      self._writes += 1
+      if self._index is not None:
+        self._index.remove(target.id)
+
+  def _on_commit(self, session):
+    session.info.pop(self, None)
+
+  def _on_rollback(self, session, previous_transaction):
+    ids = session.info.pop(self, None)
+    if ids:
+      with self._lock:
+        self._dirty.update(ids)
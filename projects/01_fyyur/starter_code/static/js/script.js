@@ -2,3 +2,50 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// "Load more" buttons on the venue and artist pages append the next page of
+// shows, fetched as JSON from the button's data-url.
+document.addEventListener('click', function (event) {
+  var button = event.target.closest && event.target.closest('.load-more');
+  if (!button) {
+    return;
+  }
+  var kind = button.getAttribute('data-kind');
+  var url = button.getAttribute('data-url') + '&after=' + encodeURIComponent(button.getAttribute('data-cursor'));
+  button.disabled = true;
+
+  fetch(url).then(function (response) {
+    return response.json();
+  }).then(function (data) {
+    var row = document.getElementById(button.getAttribute('data-target'));
+    data.shows.forEach(function (show) {
+      var column = document.createElement('div');
+      column.className = 'col-sm-4';
+      var tile = document.createElement('div');
+      tile.className = 'tile tile-show';
+      var img = document.createElement('img');
+      img.src = show[kind + '_image_link'] || '';
+      img.alt = kind === 'artist' ? 'Show Artist Image' : 'Show Venue Image';
+      var name = document.createElement('h5');
+      var link = document.createElement('a');
+      link.href = '/' + kind + 's/' + show[kind + '_id'];
+      link.textContent = show[kind + '_name'];
+      name.appendChild(link);
+      var time = document.createElement('h6');
+      time.textContent = show.start_time_display;
+      tile.appendChild(img);
+      tile.appendChild(name);
+      tile.appendChild(time);
+      column.appendChild(tile);
+      row.appendChild(column);
+    });
+    if (data.next_cursor) {
+      button.setAttribute('data-cursor', data.next_cursor);
+      button.disabled = false;
+    } else {
+      button.parentNode.removeChild(button);
+    }
+  }).catch(function () {
+    button.disabled = false;
+  });
+});
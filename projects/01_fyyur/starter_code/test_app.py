@@ -0,0 +1,33 @@
+import os
+import unittest
+
+# the filters need no database; keeps the import from pointing at postgres
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import babel.dates
+import dateutil.parser
+
+from app import format_datetime, DATETIME_FORMATS
+
+
+class FormatDatetimeTestCase(unittest.TestCase):
+    """This class represents the datetime template filter"""
+
+    def test_offset_is_kept(self):
+        self.assertEqual(format_datetime('2035-04-01T20:00:00-05:00', 'full'),
+            'Sunday April, 1, 2035 at 8:00PM')
+
+    def test_utc_suffix(self):
+        self.assertEqual(format_datetime('2035-04-01T20:00:00Z', 'full'),
+            'Sunday April, 1, 2035 at 8:00PM')
+
+    def test_matches_babel(self):
+        for value in ('2019-05-21T21:30:00.000Z', '2035-04-01T20:00:00-05:00', '2035-04-01 20:00:00'):
+            for format in ('full', 'medium'):
+                expected = babel.dates.format_datetime(dateutil.parser.parse(value), DATETIME_FORMATS[format])
+                self.assertEqual(format_datetime(value, format), expected)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -1,104 +1,337 @@
+import io
 import os
+import click
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
 
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, Category
+from .caches import CategoryMap, QuestionIndex
+from .quiz import QuizSessions, next_question
+from .search import QuestionSearch, create_search_index, enable_search_index
+from .importer import QuestionImporter, format_of, read_rows
+from .convert import add_question_keys, convert_categories
+from flask_metrics import Metrics
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+QUIZ_SESSION_TTL = 3600
+IMPORT_BATCH_SIZE = 10000
+IMPORT_FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'jsonl', 'application/jsonl': 'jsonl'}
+
+categories = CategoryMap(db, Category)
+question_index = QuestionIndex(db, Question)
+quiz_sessions = QuizSessions(ttl=QUIZ_SESSION_TTL)
+question_search = QuestionSearch(db, Question)
+enable_search_index(Question.__table__)
+
+def int_arg(name, default=None):
+  # a query argument that has to be an integer when given, 400 otherwise
+  value = request.args.get(name)
+  if value is None:
+    return default
+  try:
+    return int(value)
+  except ValueError:
+    abort(400)
+
+def get_page_args():
+  # ?after=<id of the last question shown> or ?page=N, and ?limit=
+  limit = min(max(int_arg('limit', QUESTIONS_PER_PAGE), 1), MAX_QUESTIONS_PER_PAGE)
+  after = int_arg('after')
+  page = max(int_arg('page', 1), 1)
+  return after, page, limit
+
+def questions_page(category=None):
+  '''
+  one page of questions in id order, through the primary key
+  or the (category, id) index, however deep the page is
+  @return (formatted questions, next cursor or None on the last page)
+  '''
+  after, page, limit = get_page_args()
+  query = Question.query
+  if category is not None:
+    query = query.filter(Question.category == category)
+  if after is not None:
+    query = query.filter(Question.id > after)
+  elif page > 1:
+    start = question_index.page_start(category, page, limit)
+    if start is None:
+      abort(404)
+    query = query.filter(Question.id >= start)
+  rows = query.order_by(Question.id).limit(limit + 1).all()
+  next_cursor = rows[limit - 1].id if len(rows) > limit else None
+  return [question.format() for question in rows[:limit]], next_cursor
+
+def get_quiz_category(body):
+  # the quiz_category id of a quiz request, None for every category
+  if not isinstance(body, dict):
+    abort(400)
+  quiz_category = body.get('quiz_category') or {}
+  try:
+    category_id = int(quiz_category.get('id', 0) if isinstance(quiz_category, dict) else quiz_category)
+  except (TypeError, ValueError):
+    abort(400)
+  if category_id and categories.type_of(category_id) is None:
+    abort(404)
+  return category_id or None
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
   setup_db(app)
-  
+  Metrics(app)
+  CORS(app, resources={r"/*": {"origins": "*"}})
+
+  @app.after_request
+  def after_request(response):
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
+    response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    return response
+
+  @app.route('/categories')
+  def get_categories():
+    return jsonify({
+      'success': True,
+      'categories': categories.get()
+    })
+
   '''
-  @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
+  GET /questions?page=N or ?after=<next_cursor>
+  total_questions comes from the in-memory question index, not a COUNT(*)
   '''
+  @app.route('/questions')
+  def get_questions():
+    questions, next_cursor = questions_page()
+    return jsonify({
+      'success': True,
+      'questions': questions,
+      'total_questions': question_index.count(),
+      'categories': categories.get(),
+      'current_category': None,
+      'next_cursor': next_cursor
+    })
+
+  @app.route('/questions/<int:question_id>', methods=['DELETE'])
+  def delete_question(question_id):
+    question = Question.query.get(question_id)
+    if question is None:
+      abort(404)
+    try:
+      question.delete()
+    except Exception:
+      db.session.rollback()
+      abort(422)
+    return jsonify({
+      'success': True,
+      'deleted': question_id
+    })
 
   '''
-  @TODO: Use the after_request decorator to set Access-Control-Allow
+  POST /questions {"question": ..., "answer": ..., "category": ..., "difficulty": 1-5}
+  or, to search, {"searchTerm": ..., "category": optional id} with ?page=N&limit=
   '''
+  @app.route('/questions', methods=['POST'])
+  def create_question():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+      abort(400)
+    if 'searchTerm' in body:
+      return search_questions(body)
+    question_text = body.get('question')
+    answer = body.get('answer')
+    category = body.get('category')
+    try:
+      difficulty = int(body.get('difficulty'))
+    except (TypeError, ValueError):
+      abort(422)
+    if not question_text or not answer or categories.type_of(category) is None or not 1 <= difficulty <= 5:
+      abort(422)
+
+    question = Question(question=question_text, answer=answer, category=int(category), difficulty=difficulty)
+    try:
+      question.insert()
+    except Exception:
+      db.session.rollback()
+      abort(422)
+    return jsonify({
+      'success': True,
+      'created': question.id
+    }), 201
+
+  def search_questions(body):
+    search_term = body.get('searchTerm')
+    category_id = body.get('category')
+    if search_term is not None and not isinstance(search_term, str):
+      abort(400)
+    category_type = None
+    if category_id not in (None, '', 0, '0'):
+      category_type = categories.type_of(category_id)
+      if category_type is None:
+        abort(404)
+    else:
+      category_id = None
+
+    after, page, limit = get_page_args()
+    questions, total = question_search.search(search_term, category_id, (page - 1) * limit, limit)
+    return jsonify({
+      'success': True,
+      'questions': [question.format() for question in questions],
+      'total_questions': total,
+      'current_category': category_type
+    })
+
+  @app.route('/categories/<int:category_id>/questions')
+  def get_category_questions(category_id):
+    category_type = categories.type_of(category_id)
+    if category_type is None:
+      abort(404)
+    questions, next_cursor = questions_page(category_id)
+    return jsonify({
+      'success': True,
+      'questions': questions,
+      'total_questions': question_index.count(category_id),
+      'current_category': category_type,
+      'next_cursor': next_cursor
+    })
 
   '''
-  @TODO: 
-  Create an endpoint to handle GET requests 
-  for all available categories.
+  POST /quizzes
+  {"previous_questions": [ids], "quiz_category": {"type": ..., "id": ...}}, id 0 for every category
   '''
+  @app.route('/quizzes', methods=['POST'])
+  def play_quiz():
+    body = request.get_json(silent=True)
+    category_id = get_quiz_category(body)
+    try:
+      previous = set(int(id) for id in body.get('previous_questions') or [])
+    except (TypeError, ValueError):
+      abort(400)
 
+    question = next_question(question_index, app, category_id, previous)
+    return jsonify({
+      'success': True,
+      'question': question.format() if question is not None else None
+    })
 
-  '''
-  @TODO: 
-  Create an endpoint to handle GET requests for questions, 
-  including pagination (every 10 questions). 
-  This endpoint should return a list of questions, 
-  number of total questions, current category, categories. 
+  def next_session_question(session):
+    question = next_question(question_index, app, session.category, session.asked, len(session.asked))
+    if question is None:
+      return None
+    session.asked.add(question.id)
+    return question.format()
 
-  TEST: At this point, when you start the application
-  you should see questions and categories generated,
-  ten questions per page and pagination at the bottom of the screen for three pages.
-  Clicking on the page numbers should update the questions. 
   '''
-
+  POST /quizzes/sessions {"quiz_category": {...}}
+  starts a quiz whose asked questions are kept on the server
   '''
-  @TODO: 
-  Create an endpoint to DELETE question using a question ID. 
+  @app.route('/quizzes/sessions', methods=['POST'])
+  def start_quiz_session():
+    session = quiz_sessions.create(get_quiz_category(request.get_json(silent=True) or {}))
+    return jsonify({
+      'success': True,
+      'session_id': session.id,
+      'question': next_session_question(session)
+    }), 201
 
-  TEST: When you click the trash icon next to a question, the question will be removed.
-  This removal will persist in the database and when you refresh the page. 
   '''
-
+  POST /quizzes/sessions/<session_id>
+  the next question of the session, 404 once it expired
   '''
-  @TODO: 
-  Create an endpoint to POST a new question, 
-  which will require the question and answer text, 
-  category, and difficulty score.
+  @app.route('/quizzes/sessions/<session_id>', methods=['POST'])
+  def next_quiz_session_question(session_id):
+    session = quiz_sessions.get(session_id)
+    if session is None:
+      abort(404)
+    return jsonify({
+      'success': True,
+      'session_id': session.id,
+      'question': next_session_question(session)
+    })
 
-  TEST: When you submit a question on the "Add" tab, 
-  the form will clear and the question will appear at the end of the last page
-  of the questions list in the "List" tab.  
   '''
-
+  DELETE /quizzes/sessions/<session_id>
+  ends the session before it expires
   '''
-  @TODO: 
-  Create a POST endpoint to get questions based on a search term. 
-  It should return any questions for whom the search term 
-  is a substring of the question. 
+  @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+  def end_quiz_session(session_id):
+    if not quiz_sessions.delete(session_id):
+      abort(404)
+    return jsonify({
+      'success': True,
+      'deleted': session_id
+    })
 
-  TEST: Search by any phrase. The questions list will update to include 
-  only question that include that string within their question. 
-  Try using the word "title" to start. 
   '''
-
+  POST /questions/import
+  a CSV (Content-Type: text/csv) or JSON lines (application/x-ndjson) body,
+  or a multipart upload of such a file as "file"
   '''
-  @TODO: 
-  Create a GET endpoint to get questions based on category. 
+  @app.route('/questions/import', methods=['POST'])
+  def import_questions():
+    upload = request.files.get('file')
+    if upload is not None:
+      source, format, stream = upload.filename or 'file', format_of(upload.filename or ''), upload.stream
+    else:
+      source, format, stream = 'body', IMPORT_FORMATS.get(request.mimetype), request.stream
+      if format is None:
+        abort(400)
+    rows = read_rows(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), format)
+    importer = QuestionImporter(db, Question, categories, question_index, IMPORT_BATCH_SIZE)
+    report = importer.run([(source, rows)])
+    return jsonify({
+      'success': True,
+      **report.format()
+    })
 
-  TEST: In the "List" tab / main screen, clicking on one of the 
-  categories in the left column will cause only questions of that 
-  category to be shown. 
-  '''
+  @app.cli.command('import-questions')
+  @click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+  @click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows per transaction.')
+  def import_questions_command(paths, batch_size):
+    '''Imports questions from CSV (.csv) or JSON lines files.'''
+    def sources():
+      for path in paths:
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+          yield path, read_rows(stream, format_of(path))
 
+    importer = QuestionImporter(db, Question, categories, question_index, batch_size)
+    report = importer.run(sources(), progress=lambda report: click.echo(report.summary()))
+    for error in report.errors:
+      click.echo(error, err=True)
+    if report.invalid > len(report.errors):
+      click.echo('... {} more invalid rows'.format(report.invalid - len(report.errors)), err=True)
+    click.echo(report.summary())
 
-  '''
-  @TODO: 
-  Create a POST endpoint to get questions to play the quiz. 
-  This endpoint should take category and previous question parameters 
-  and return a random questions within the given category, 
-  if provided, and that is not one of the previous questions. 
+  @app.cli.command('create-search-index')
+  def create_search_index_command():
+    '''Adds the full-text search index to an existing questions table.'''
+    create_search_index(db, echo=click.echo)
+    question_search.forget()
 
-  TEST: In the "Play" tab, after a user selects "All" or a category,
-  one question at a time is displayed, the user is allowed to answer
-  and shown whether they were correct or not. 
-  '''
+  @app.cli.command('convert-categories')
+  def convert_categories_command():
+    '''Turns questions.category into an indexed integer key of categories.'''
+    convert_categories(db, Question, echo=click.echo)
+
+  @app.cli.command('add-question-keys')
+  def add_question_keys_command():
+    '''Adds and fills questions.question_key, which imports find duplicates by.'''
+    add_question_keys(db, echo=click.echo)
+
+  def error_handler(status, message):
+    def handler(error):
+      return jsonify({
+        'success': False,
+        'error': status,
+        'message': message
+      }), status
+    return handler
+
+  for status, message in ((400, 'bad request'), (404, 'resource not found'),
+      (405, 'method not allowed'), (422, 'unprocessable'), (500, 'internal server error')):
+    app.register_error_handler(status, error_handler(status, message))
 
-  '''
-  @TODO: 
-  Create error handlers for all expected errors 
-  including 404 and 422. 
-  '''
-  
   return app
 
     
\ No newline at end of file
@@ -0,0 +1,235 @@
+import time
+import threading
+from array import array
+from bisect import bisect_left
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+'''
+In-process caches of the trivia data, kept current through ORM events.
+
+Both are reloaded after a session rolls back and once they are older than
+max_age seconds, so writes made by other processes show up eventually.
+They also rebuild when used with a different engine (ex: the test database).
+'''
+
+
+def category_key(category):
+  return int(category) if category is not None else None
+
+
+'''
+CategoryMap
+    the {id: type} dictionary of every category, loaded once
+    and reloaded after a category is written
+'''
+class CategoryMap:
+  def __init__(self, db, model, max_age=300):
+    self.db = db
+    self.model = model
+    self.max_age = max_age
+    self._types = None
+    self._engine = None
+    self._loaded_at = None
+    self._lock = threading.Lock()
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+      event.listen(model, name, self._invalidate)
+    event.listen(Session, 'after_soft_rollback', self._invalidate)
+
+  '''
+  get()
+      @return {'1': 'Science', ...}, shared between callers, do not modify it
+  '''
+  def get(self):
+    with self._lock:
+      engine = self.db.engine
+      stale = self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age
+      if self._types is None or stale or self._engine is not engine:
+        rows = self.db.session.query(self.model.id, self.model.type).order_by(self.model.id)
+        self._types = {str(id): type for id, type in rows}
+        self._engine = engine
+        self._loaded_at = time.monotonic()
+      return self._types
+
+  def type_of(self, category_id):
+    return self.get().get(str(category_id))
+
+  def _invalidate(self, *args):
+    self._types = None
+
+
+'''
+QuestionIndex
+    the sorted ids of every question, overall and per category
+    - count(category) is the size of the list
+    - page_start(category, page, per_page) is the id a page starts from,
+      so a page is fetched with WHERE id >= start ORDER BY id LIMIT per_page
+      through the primary key or the (category, id) index
+    it is only built in the request when nothing was built yet for the engine;
+    once stale (max_age, a rollback, invalidate()) it is rebuilt in the
+    background and the current arrays are served meanwhile
+'''
+class QuestionIndex:
+  # key of the array of every question, questions without a category included
+  ALL = 'all'
+
+  def __init__(self, db, model, max_age=300):
+    self.db = db
+    self.model = model
+    self.max_age = max_age
+    self._ids = None
+    self._engine = None
+    self._built_at = None
+    self._building = False
+    self._writes = 0
+    self._lock = threading.RLock()
+
+    event.listen(model, 'after_insert', self._on_insert)
+    event.listen(model, 'after_update', self._on_update)
+    event.listen(model, 'after_delete', self._on_delete)
+    event.listen(Session, 'after_soft_rollback', self._on_rollback)
+
+  '''
+  ids(category=None)
+      @return sorted array of question ids, in the category if given
+          shared with the index and never changed by it, do not modify it
+  '''
+  def ids(self, category=None):
+    with self._lock:
+      ids = self._current(current_app._get_current_object())
+    if ids is None:
+      built = self._build()
+      with self._lock:
+        self._set(*built)
+        ids = self._ids
+    return ids.get(self._key(category), array('q'))
+
+  '''
+  peek(app, category=None)
+      like ids() but never waits for the index to be built:
+      @return None while it is built in the background,
+          the current (maybe stale) array while it is rebuilt
+  '''
+  def peek(self, app, category=None):
+    with self._lock:
+      ids = self._current(app)
+      if ids is None:
+        self._build_in_background(app)
+        return None
+      return ids.get(self._key(category), array('q'))
+
+  def count(self, category=None):
+    return len(self.ids(category))
+
+  def invalidate(self):
+    # after writes that bypass the ORM events (ex: a bulk import)
+    with self._lock:
+      self._built_at = None
+
+  def page_start(self, category, page, per_page):
+    ids = self.ids(category)
+    position = (page - 1) * per_page
+    return ids[position] if 0 <= position < len(ids) else None
+
+  def _key(self, category):
+    return self.ALL if category is None else category_key(category)
+
+  def _keys(self, category):
+    # a question without a category is only in the array of every question
+    return (self.ALL,) if category is None else (self.ALL, category_key(category))
+
+  def _is_stale(self):
+    return self._built_at is None or time.monotonic() - self._built_at > self.max_age
+
+  def _current(self, app):
+    # the built arrays, None when there are none for the current engine
+    if self._ids is None or self._engine is not self.db.engine:
+      return None
+    if self._is_stale():
+      self._build_in_background(app)
+    return self._ids
+
+  def _build(self):
+    engine = self.db.engine
+    ids = {self.ALL: array('q')}
+    rows = self.db.session.query(self.model.category, self.model.id).order_by(self.model.id)
+    for category, id in rows:
+      ids[self.ALL].append(id)
+      if category is not None:
+        ids.setdefault(category_key(category), array('q')).append(id)
+    return ids, engine
+
+  def _set(self, ids, engine):
+    self._ids = ids
+    self._engine = engine
+    self._built_at = time.monotonic()
+
+  def _build_in_background(self, app):
+    if self._building:
+      return
+    self._building = True
+    writes = self._writes
+
+    def build():
+      try:
+        with app.app_context():
+          try:
+            built = self._build()
+          finally:
+            self.db.session.remove()
+        with self._lock:
+          self._set(*built)
+          if self._writes != writes:
+            # a write may have landed after the rows were read: build again next time
+            self._built_at = None
+      finally:
+        self._building = False
+
+    threading.Thread(target=build, daemon=True).start()
+
+  # arrays are replaced, never changed in place, so callers can read the
+  # ones they got without the lock while questions are written
+  def _add(self, category, id):
+    for key in self._keys(category):
+      ids = self._ids.get(key, array('q'))
+      position = bisect_left(ids, id)
+      if position == len(ids) or ids[position] != id:
+        self._ids[key] = ids[:position] + array('q', (id,)) + ids[position:]
+
+  def _remove(self, category, id):
+    for key in self._keys(category):
+      ids = self._ids.get(key)
+      if ids is None:
+        continue
+      position = bisect_left(ids, id)
+      if position < len(ids) and ids[position] == id:
+        self._ids[key] = ids[:position] + ids[position + 1:]
+
+  def _on_insert(self, mapper, connection, target):
+    with self._lock:
+      self._writes += 1
+      if self._ids is not None:
+        self._add(target.category, target.id)
+
+  def _on_update(self, mapper, connection, target):
+    history = inspect(target).attrs.category.history
+    if not history.deleted:
+      return
+    with self._lock:
+      self._writes += 1
+      if self._ids is not None:
+        for category in history.deleted:
+          self._remove(category, target.id)
+        self._add(target.category, target.id)
+
+  def _on_delete(self, mapper, connection, target):
+    with self._lock:
+      self._writes += 1
+      if self._ids is not None:
+        self._remove(target.category, target.id)
+
+  def _on_rollback(self, session, previous_transaction):
+    # ids of rolled back writes stay in the arrays until the rebuild
+    self.invalidate()
@@ -0,0 +1,130 @@
+from sqlalchemy import Integer, bindparam, inspect, text
+
+from models import question_key
+
+from .search import SQLITE_TEARDOWN
+
+'''
+Conversion of questions.category to an integer key of categories.
+
+Databases created by db.create_all() before Question.category was an
+Integer hold the category ids as strings, without a foreign key or the
+(category, id) index. convert_categories(db):
+    - maps every distinct value to the id of a category, by id or by type
+      (' 2', 'Art' and 'art' all become 2), unknown values to NULL
+    - on Postgres, alters the column type in place and adds the foreign key
+    - on SQLite, which cannot alter a column type, copies the rows into a
+      new questions table and drops the old one, keeping the ids; the
+      search table is dropped with it and made again with the new table
+    - creates ix_questions_category_id when missing
+It does nothing on a database that is already converted, like one loaded
+from trivia.psql.
+'''
+
+
+def category_column(inspector):
+  for column in inspector.get_columns('questions'):
+    if column['name'] == 'category':
+      return column
+
+
+def has_category_key(inspector):
+  return any(key['constrained_columns'] == ['category'] and key['referred_table'] == 'categories'
+    for key in inspector.get_foreign_keys('questions'))
+
+
+def has_category_index(inspector):
+  return any(index['column_names'][:1] == ['category'] for index in inspector.get_indexes('questions'))
+
+
+'''
+category_mapping(connection)
+    @return {stored value: category id or None} for every distinct value
+'''
+def category_mapping(connection):
+  ids = {}
+  for id, type in connection.execute(text('SELECT id, type FROM categories')):
+    ids[str(id)] = id
+    if type:
+      ids.setdefault(type.strip().lower(), id)
+  values = connection.execute(text('SELECT DISTINCT category FROM questions WHERE category IS NOT NULL'))
+  return {value: ids.get(str(value).strip().lower()) for value, in values}
+
+
+def convert_categories(db, model, echo=print):
+  engine = db.engine
+  inspector = inspect(engine)
+  is_integer = isinstance(category_column(inspector)['type'], Integer)
+  if is_integer and has_category_key(inspector) and has_category_index(inspector):
+    echo('questions.category is already an indexed integer key')
+    return
+
+  with engine.begin() as connection:
+    if not is_integer:
+      mapping = category_mapping(connection)
+      for value, id in mapping.items():
+        if str(id) != value:
+          connection.execute(text('UPDATE questions SET category = :id WHERE category = :value'),
+            id=None if id is None else str(id), value=value)
+      unknown = sorted(str(value) for value, id in mapping.items() if id is None)
+      if unknown:
+        echo('unknown categories set to NULL: {}'.format(', '.join(unknown)))
+    else:
+      connection.execute(text('UPDATE questions SET category = NULL '
+        'WHERE category IS NOT NULL AND category NOT IN (SELECT id FROM categories)'))
+
+    if engine.dialect.name == 'sqlite':
+      for statement in SQLITE_TEARDOWN:
+        connection.execute(text(statement))
+      connection.execute(text('DROP INDEX IF EXISTS ix_questions_category_id'))
+      connection.execute(text('ALTER TABLE questions RENAME TO questions_old'))
+      model.__table__.create(connection)
+      connection.execute(text(
+        'INSERT INTO questions (id, question, answer, category, difficulty) '
+        'SELECT id, question, answer, CAST(category AS INTEGER), difficulty FROM questions_old'))
+      connection.execute(text('DROP TABLE questions_old'))
+    else:
+      if not is_integer:
+        connection.execute(text(
+          'ALTER TABLE questions ALTER COLUMN category TYPE integer USING category::integer'))
+      if not has_category_key(inspector):
+        connection.execute(text(
+          'ALTER TABLE questions ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category) '
+          'REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL'))
+      if not has_category_index(inspector):
+        connection.execute(text('CREATE INDEX ix_questions_category_id ON questions (category, id)'))
+  echo('questions.category converted to an integer key of categories')
+
+
+'''
+add_question_keys(db)
+    adds questions.question_key and its index to a database made before them,
+    then fills the key of every question that has none, batch_size per
+    transaction; safe to run again, ex: after rows were written by other tools
+'''
+def add_question_keys(db, echo=print, batch_size=1000):
+  engine = db.engine
+  inspector = inspect(engine)
+  if not any(column['name'] == 'question_key' for column in inspector.get_columns('questions')):
+    with engine.begin() as connection:
+      connection.execute(text('ALTER TABLE questions ADD COLUMN question_key BIGINT'))
+    echo('questions.question_key added')
+  if not any(index['column_names'] == ['question_key'] for index in inspector.get_indexes('questions')):
+    with engine.begin() as connection:
+      connection.execute(text('CREATE INDEX ix_questions_question_key ON questions (question_key)'))
+
+  update = text('UPDATE questions SET question_key = :key WHERE id = :id').bindparams(
+    bindparam('key'), bindparam('id'))
+  filled = 0
+  last_id = 0
+  while True:
+    with engine.begin() as connection:
+      rows = connection.execute(text(
+        'SELECT id, question FROM questions WHERE question_key IS NULL AND question IS NOT NULL AND id > :id '
+        'ORDER BY id LIMIT :limit'), id=last_id, limit=batch_size).fetchall()
+      if not rows:
+        break
+      connection.execute(update, [{'key': question_key(question), 'id': id} for id, question in rows])
+    filled += len(rows)
+    last_id = rows[-1][0]
+  echo('{} question keys filled'.format(filled))
@@ -0,0 +1,198 @@
+import csv
+import io
+import json
+import time
+
+from models import question_key
+
+'''
+Bulk import of questions from CSV or JSON lines.
+
+Rows are streamed, checked, de-duplicated and written batch_size rows per
+transaction. A row is a duplicate of a row read before it, or of a question
+in the bank, with the same text ignoring case, punctuation and spacing
+(the same question_key): each batch looks up only its own keys, through the
+questions.question_key index, so small imports do not read the whole bank.
+Batches are written:
+    - on Postgres with COPY
+    - elsewhere with one executemany INSERT
+The questions table is written directly, bypassing the ORM: the in-memory
+question index is dropped at the end so it is rebuilt with the new ids.
+
+CSV files need a header row with the question, answer, category and
+difficulty columns; JSON lines are objects with the same keys. category is
+the id or the type of a category, difficulty a number from 1 to 5.
+'''
+
+MAX_ERRORS_KEPT = 20
+# question keys per lookup of the bank, below SQLite's parameter limit
+LOOKUP_SIZE = 500
+
+
+'''
+read_rows(stream, format)
+    @param stream text stream of CSV ('csv') or JSON lines ('jsonl')
+    @return iterator of (line number, dict of the row or None when it is not JSON)
+'''
+def read_rows(stream, format):
+  if format == 'csv':
+    reader = csv.DictReader(stream)
+    for row in reader:
+      yield reader.line_num, row
+    return
+  for line_number, line in enumerate(stream, 1):
+    if not line.strip():
+      continue
+    try:
+      row = json.loads(line)
+    except ValueError:
+      row = None
+    yield line_number, row if isinstance(row, dict) else None
+
+
+def format_of(filename):
+  return 'csv' if filename.lower().endswith('.csv') else 'jsonl'
+
+
+class ImportReport:
+  def __init__(self):
+    self.read = 0
+    self.imported = 0
+    self.duplicates = 0
+    self.invalid = 0
+    self.errors = []
+    self.started = time.monotonic()
+
+  def reject(self, source, line_number, reason):
+    self.invalid += 1
+    if len(self.errors) < MAX_ERRORS_KEPT:
+      self.errors.append('{}:{}: {}'.format(source, line_number, reason))
+
+  def summary(self):
+    elapsed = time.monotonic() - self.started
+    return '{} read, {} imported, {} duplicates, {} invalid in {:.1f}s ({:.0f} rows/s)'.format(
+      self.read, self.imported, self.duplicates, self.invalid, elapsed, self.read / elapsed if elapsed else 0)
+
+  def format(self):
+    return {
+      'read': self.read,
+      'imported': self.imported,
+      'duplicates': self.duplicates,
+      'invalid': self.invalid,
+      'errors': self.errors
+    }
+
+
+'''
+QuestionImporter
+    run([(source name, rows from read_rows), ...], progress=None)
+        @param progress called with the ImportReport after every batch
+        @return the ImportReport
+'''
+class QuestionImporter:
+  def __init__(self, db, model, categories, question_index, batch_size=10000):
+    self.db = db
+    self.table = model.__table__
+    self.categories = categories
+    self.question_index = question_index
+    self.batch_size = batch_size
+
+  def run(self, sources, progress=None):
+    report = ImportReport()
+    category_ids = self._category_ids()
+    seen = set()
+    batch = []
+    try:
+      for source, rows in sources:
+        for line_number, row in rows:
+          report.read += 1
+          values, reason = self._check(row, category_ids)
+          if values is None:
+            report.reject(source, line_number, reason)
+            continue
+          if values['question_key'] in seen:
+            report.duplicates += 1
+            continue
+          seen.add(values['question_key'])
+          batch.append(values)
+          if len(batch) >= self.batch_size:
+            self._write(batch, report, progress)
+            batch = []
+      if batch:
+        self._write(batch, report, progress)
+    finally:
+      if report.imported:
+        self.question_index.invalidate()
+    return report
+
+  def _category_ids(self):
+    # accepts '1' as well as 'science' for the Science category
+    category_ids = {}
+    for id, type in self.categories.get().items():
+      category_ids[id] = int(id)
+      category_ids[type.strip().lower()] = int(id)
+    return category_ids
+
+  def _known_questions(self, keys):
+    # the question keys among the given ones that are already in the bank
+    column = self.table.c.question_key
+    keys = list(set(keys))
+    known = set()
+    for start in range(0, len(keys), LOOKUP_SIZE):
+      rows = self.db.session.query(column).filter(column.in_(keys[start:start + LOOKUP_SIZE]))
+      known.update(key for key, in rows)
+    return known
+
+  def _check(self, row, category_ids):
+    if row is None:
+      return None, 'not a JSON object'
+    question = str(row.get('question') or '').strip()
+    answer = str(row.get('answer') or '').strip()
+    if not question or not answer:
+      return None, 'question and answer are required'
+    category = category_ids.get(str(row.get('category') or '').strip().lower())
+    if category is None:
+      return None, 'unknown category {!r}'.format(row.get('category'))
+    try:
+      difficulty = int(row.get('difficulty'))
+    except (TypeError, ValueError):
+      difficulty = None
+    if difficulty is None or not 1 <= difficulty <= 5:
+      return None, 'difficulty must be 1 to 5'
+    return {'question': question, 'answer': answer, 'category': category, 'difficulty': difficulty,
+      'question_key': question_key(question)}, None
+
+  def _write(self, batch, report, progress):
+    known = self._known_questions(values['question_key'] for values in batch)
+    rows = [values for values in batch if values['question_key'] not in known]
+    report.duplicates += len(batch) - len(rows)
+    if rows:
+      connection = self.db.session.connection()
+      try:
+        if connection.dialect.name == 'postgresql':
+          self._copy(connection, rows)
+        else:
+          connection.execute(self.table.insert(), rows)
+        self.db.session.commit()
+      except Exception:
+        self.db.session.rollback()
+        raise
+    report.imported += len(rows)
+    if progress is not None:
+      progress(report)
+
+  def _copy(self, connection, batch):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in batch:
+      writer.writerow((values['question'], values['answer'], values['category'], values['difficulty'],
+        values['question_key']))
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+      cursor.copy_expert(
+        'COPY {} (question, answer, category, difficulty, question_key) FROM STDIN WITH (FORMAT csv)'.format(
+          self.table.name),
+        buffer)
+    finally:
+      cursor.close()
@@ -0,0 +1,201 @@
+import random
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from sqlalchemy import func
+
+from models import Question
+
+'''
+Quiz question selection.
+
+The next question is drawn from the in-memory id array of the category
+(QuestionIndex), skipping the ids already asked:
+    - while at least a quarter of the category is left, random positions
+      are drawn until one was not asked, fewer than 4 draws on average
+    - past that, the unasked ids are counted through once, which only
+      happens after most of the category was asked
+so a draw costs O(1) besides reading previous_questions. The index replaces
+its arrays on writes instead of changing them, so the array is read without
+holding the index lock.
+
+A quiz session (QuizSessions) keeps the asked ids on the server in an
+IdBitset instead, so each step sends and reads a session id only.
+
+While the index is cold (first requests of a process) a random id is
+picked between the category's min and max id and the nearest unasked
+question at or after it is read through the (category, id) index.
+'''
+
+def contains(ids, id):
+  position = bisect_left(ids, id)
+  return position < len(ids) and ids[position] == id
+
+
+'''
+pick_from_ids(ids, previous, asked=None, rng=random)
+    @param ids sorted array of candidate question ids
+    @param previous set (or IdBitset) of question ids already asked
+    @param asked how many of ids were asked, counted from previous when None
+    @return a random id of ids not in previous, or None when all were asked
+'''
+def pick_from_ids(ids, previous, asked=None, rng=random):
+  if asked is None:
+    asked = sum(1 for id in previous if contains(ids, id))
+  remaining = len(ids) - asked
+  if remaining > 0 and remaining * 4 >= len(ids):
+    for attempt in range(32):
+      id = ids[rng.randrange(len(ids))]
+      if id not in previous:
+        return id
+  # few left, or asked was off (ex: an asked question was deleted since)
+  unasked = [id for id in ids if id not in previous]
+  return rng.choice(unasked) if unasked else None
+
+
+'''
+pick_from_table(category, previous, rng=random)
+    @return a random Question of the category (all when None) not in previous, or None
+'''
+def pick_from_table(category, previous, rng=random):
+  query = Question.query
+  if category is not None:
+    query = query.filter(Question.category == category)
+  low, high = query.with_entities(func.min(Question.id), func.max(Question.id)).one()
+  if low is None:
+    return None
+  if previous:
+    query = query.filter(~Question.id.in_(previous))
+  start = rng.randint(low, high)
+  return query.filter(Question.id >= start).order_by(Question.id).first() \
+    or query.filter(Question.id < start).order_by(Question.id.desc()).first()
+
+
+'''
+next_question(index, app, category, previous, asked=None)
+    @param index the QuestionIndex
+    @param category category id, None for every category
+    @param previous set (or IdBitset) of question ids already asked
+    @param asked len(previous) when every id in it is of the category, see pick_from_ids
+    @return the next Question, or None when the category is exhausted
+'''
+def next_question(index, app, category, previous, asked=None):
+  ids = index.peek(app, category)
+  if ids is None:
+    return pick_from_table(category, previous)
+  # an id may belong to a question another process deleted since the index was built
+  missing = set()
+  skip = previous
+  for attempt in range(3):
+    id = pick_from_ids(ids, skip, asked)
+    if id is None:
+      return None
+    question = Question.query.get(id)
+    if question is not None:
+      return question
+    missing.add(id)
+    skip = set(previous) | missing
+    asked = None
+  return pick_from_table(category, skip)
+
+
+'''
+IdBitset
+    set of non-negative ids kept as 64-bit words, stored sparsely by word index
+    so a handful of ids anywhere in a large id range stays small
+'''
+class IdBitset:
+  __slots__ = ('words', 'count')
+
+  def __init__(self):
+    self.words = {}
+    self.count = 0
+
+  def add(self, id):
+    word, bit = id >> 6, 1 << (id & 63)
+    bits = self.words.get(word, 0)
+    if not bits & bit:
+      self.words[word] = bits | bit
+      self.count += 1
+
+  def __contains__(self, id):
+    return bool(self.words.get(id >> 6, 0) & (1 << (id & 63)))
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    for word, bits in self.words.items():
+      while bits:
+        lowest = bits & -bits
+        yield (word << 6) + lowest.bit_length() - 1
+        bits ^= lowest
+
+
+'''
+QuizSession
+    the category of a quiz and the ids of the questions it already asked
+'''
+class QuizSession:
+  __slots__ = ('id', 'category', 'asked', 'expires_at')
+
+  def __init__(self, id, category, expires_at):
+    self.id = id
+    self.category = category
+    self.asked = IdBitset()
+    self.expires_at = expires_at
+
+
+'''
+QuizSessions
+    in-process quiz sessions, so a client sends its session id instead of
+    the whole previous_questions list on every step
+    - a session expires ttl seconds after it was last used
+    - at most maxsize sessions are kept, the least recently used goes first
+    sessions live in the process that created them
+'''
+class QuizSessions:
+  def __init__(self, ttl=3600, maxsize=100000, clock=time.monotonic):
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self.clock = clock
+    self._sessions = OrderedDict()
+    self._lock = threading.Lock()
+
+  def create(self, category):
+    with self._lock:
+      now = self.clock()
+      self._evict(now)
+      session = QuizSession(secrets.token_urlsafe(16), category, now + self.ttl)
+      self._sessions[session.id] = session
+      while len(self._sessions) > self.maxsize:
+        self._sessions.popitem(last=False)
+      return session
+
+  '''
+  get(session_id)
+      @return the session, its expiry pushed back, or None if unknown or expired
+  '''
+  def get(self, session_id):
+    with self._lock:
+      now = self.clock()
+      self._evict(now)
+      session = self._sessions.get(session_id)
+      if session is not None:
+        session.expires_at = now + self.ttl
+        self._sessions.move_to_end(session_id)
+      return session
+
+  def delete(self, session_id):
+    with self._lock:
+      return self._sessions.pop(session_id, None) is not None
+
+  def _evict(self, now):
+    # least recently used first, so expired sessions are all at the front
+    while self._sessions:
+      session = next(iter(self._sessions.values()))
+      if session.expires_at > now:
+        break
+      self._sessions.popitem(last=False)
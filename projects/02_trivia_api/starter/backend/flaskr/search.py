@@ -0,0 +1,176 @@
+import re
+import time
+import weakref
+from sqlalchemy import Column, Float, Integer, MetaData, Table, event, func, literal_column, text
+from sqlalchemy.exc import OperationalError
+
+'''
+Full-text search of the question texts.
+
+    - on Postgres, a GIN index on to_tsvector('english', question),
+      ranked with ts_rank
+    - on SQLite, an FTS5 table (questions_fts) holding the question texts,
+      kept current by triggers on questions and ranked with bm25
+    - anywhere else, a LIKE scan in id order
+
+The index (or table and triggers) is created along with the questions table
+(enable_search_index), or for an existing database by create_search_index()
+(flask create-search-index); every insert, update and delete of a question,
+through the ORM or not, is then reflected by the database itself. Requests
+never run that DDL: until the index exists they use the LIKE scan.
+
+Search terms are words: every word of the search has to be in the question,
+the last one as a prefix only, so results follow what a player is typing.
+'''
+
+FTS_CONFIG = literal_column("'english'")
+WORD = re.compile(r'[^\W_]+')
+MAX_WORDS = 8
+
+# the FTS5 table, outside of the models' metadata so create_all leaves it alone
+questions_fts = Table(
+  'questions_fts', MetaData(),
+  Column('rowid', Integer),
+  Column('rank', Float)
+)
+
+SQLITE_SETUP = (
+  '''CREATE VIRTUAL TABLE questions_fts USING fts5(
+       question, content='questions', content_rowid='id', tokenize='porter unicode61')''',
+  '''CREATE TRIGGER questions_fts_insert AFTER INSERT ON questions BEGIN
+       INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+     END''',
+  '''CREATE TRIGGER questions_fts_delete AFTER DELETE ON questions BEGIN
+       INSERT INTO questions_fts(questions_fts, rowid, question) VALUES ('delete', old.id, old.question);
+     END''',
+  '''CREATE TRIGGER questions_fts_update AFTER UPDATE OF question ON questions BEGIN
+       INSERT INTO questions_fts(questions_fts, rowid, question) VALUES ('delete', old.id, old.question);
+       INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+     END''',
+  "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')",
+)
+
+SQLITE_TEARDOWN = (
+  'DROP TRIGGER IF EXISTS questions_fts_insert',
+  'DROP TRIGGER IF EXISTS questions_fts_delete',
+  'DROP TRIGGER IF EXISTS questions_fts_update',
+  'DROP TABLE IF EXISTS questions_fts',
+)
+
+POSTGRES_INDEX = "CREATE INDEX {} IF NOT EXISTS ix_questions_search ON questions " \
+  "USING GIN (to_tsvector('english', question))"
+
+# how long a database found without the index is searched with LIKE before looking again
+RECHECK_SECONDS = 60
+
+
+def search_words(search_term):
+  return WORD.findall((search_term or '').lower())[:MAX_WORDS]
+
+
+'''
+QuestionSearch
+    search(search_term, category, offset, limit)
+        @return (matching questions ranked best first, number of matches)
+'''
+class QuestionSearch:
+  def __init__(self, db, model):
+    self.db = db
+    self.model = model
+    self._backends = weakref.WeakKeyDictionary()
+
+  def search(self, search_term, category=None, offset=0, limit=10):
+    words = search_words(search_term)
+    query = self.model.query
+    if category is not None:
+      query = query.filter(self.model.category == int(category))
+    if not words:
+      return query.order_by(self.model.id).offset(offset).limit(limit).all(), query.count()
+
+    backend = self._backend()
+    if backend == 'postgresql':
+      tsquery = func.to_tsquery(FTS_CONFIG, ' & '.join(words) + ':*')
+      vector = func.to_tsvector(FTS_CONFIG, self.model.question)
+      query = query.filter(vector.op('@@')(tsquery))
+      ranked = query.order_by(func.ts_rank(vector, tsquery).desc(), self.model.id)
+    elif backend == 'sqlite':
+      match = ' '.join('"{}"'.format(word) for word in words) + '*'
+      query = query.join(questions_fts, questions_fts.c.rowid == self.model.id) \
+        .filter(literal_column('questions_fts').op('MATCH')(match))
+      ranked = query.order_by(questions_fts.c.rank, self.model.id)
+    else:
+      for word in words:
+        query = query.filter(self.model.question.ilike('%{}%'.format(word)))
+      ranked = query.order_by(self.model.id)
+    return ranked.offset(offset).limit(limit).all(), query.count()
+
+  def _backend(self):
+    engine = self.db.engine
+    backend, checked_at = self._backends.get(engine, (None, None))
+    if backend is None or backend == 'like' and time.monotonic() - checked_at > RECHECK_SECONDS:
+      backend = detect_backend(engine)
+      self._backends[engine] = (backend, time.monotonic())
+    return backend
+
+  def forget(self):
+    # look for the index again, ex: after create_search_index()
+    self._backends.clear()
+
+
+def detect_backend(engine):
+  name = engine.dialect.name
+  with engine.connect() as connection:
+    if name == 'postgresql':
+      found = connection.execute(text(
+        "SELECT 1 FROM pg_indexes WHERE tablename = 'questions' AND indexname = 'ix_questions_search'")).scalar()
+    elif name == 'sqlite':
+      found = engine.dialect.has_table(connection, 'questions_fts')
+    else:
+      found = False
+  return name if found else 'like'
+
+
+def create_sqlite_search(connection):
+  try:
+    for statement in SQLITE_SETUP:
+      connection.execute(text(statement))
+  except OperationalError:
+    # SQLite built without FTS5: searches use LIKE
+    for statement in SQLITE_TEARDOWN:
+      connection.execute(text(statement))
+
+
+'''
+enable_search_index(table)
+    creates the search index or table along with the questions table,
+    while it is empty and that costs nothing
+'''
+def enable_search_index(table):
+  @event.listens_for(table, 'after_create')
+  def create_search(target, connection, **kw):
+    if connection.dialect.name == 'postgresql':
+      connection.execute(text(POSTGRES_INDEX.format('')))
+    elif connection.dialect.name == 'sqlite':
+      create_sqlite_search(connection)
+
+
+'''
+create_search_index(db)
+    adds the search index or table to an existing questions table:
+    CREATE INDEX CONCURRENTLY on Postgres, so questions stay writable;
+    on SQLite the FTS5 table is filled from the questions in one transaction
+'''
+def create_search_index(db, echo=print):
+  engine = db.engine
+  if engine.dialect.name == 'postgresql':
+    with engine.connect() as connection:
+      connection.execution_options(isolation_level='AUTOCOMMIT') \
+        .execute(text(POSTGRES_INDEX.format('CONCURRENTLY')))
+  elif engine.dialect.name == 'sqlite':
+    with engine.begin() as connection:
+      if not engine.dialect.has_table(connection, 'questions_fts'):
+        create_sqlite_search(connection)
+  else:
+    echo('no full-text index for {}, searches use LIKE'.format(engine.dialect.name))
+    return
+  echo('search index {}'.format('ready' if detect_backend(engine) != 'like' else 'not available'))
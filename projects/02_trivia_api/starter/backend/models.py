@@ -1,5 +1,7 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import hashlib
+import re
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, Index, create_engine, event
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -19,18 +21,37 @@ def setup_db(app, database_path=database_path):
     db.init_app(app)
     db.create_all()
 
+NOT_WORD = re.compile(r'[\W_]+')
+
+def normalize_question(text):
+  return NOT_WORD.sub(' ', text.lower()).strip()
+
+'''
+question_key(text)
+    @return a signed 8-byte digest of the question text, ignoring case,
+        punctuation and spacing (what makes two questions duplicates)
+'''
+def question_key(text):
+  return int.from_bytes(hashlib.blake2b(normalize_question(text).encode(), digest_size=8).digest(), 'big', signed=True)
+
 '''
 Question
 
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  # category pages are read in id order: WHERE category = ? AND id >= ? ORDER BY id
+  # (databases made before category was an integer: flask convert-categories)
+  __table_args__ = (Index('ix_questions_category_id', 'category', 'id'),)
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
+  # question_key(question), kept current when question is set; imports look
+  # duplicates up by it (databases made before it: flask add-question-keys)
+  question_key = Column(BigInteger, index=True)
 
   def __init__(self, question, answer, category, difficulty):
     self.question = question
@@ -58,6 +79,10 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+@event.listens_for(Question.question, 'set')
+def set_question_key(target, value, oldvalue, initiator):
+  target.question_key = None if value is None else question_key(value)
+
 '''
 Category
 
@@ -4,7 +4,8 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.search import create_search_index
+from models import setup_db, db, Question, Category
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -24,6 +25,7 @@ class TriviaTestCase(unittest.TestCase):
             self.db.init_app(self.app)
             # create all tables
             self.db.create_all()
+            create_search_index(db, echo=lambda message: None)
     
     def tearDown(self):
         """Executed after reach test"""
@@ -34,6 +36,231 @@ class TriviaTestCase(unittest.TestCase):
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    def create_question(self, category=1):
+        res = self.client().post('/questions', json={
+            'question': 'Which test wrote this question?',
+            'answer': 'test_flaskr',
+            'category': category,
+            'difficulty': 1
+        })
+        self.assertEqual(res.status_code, 201)
+        return json.loads(res.data)['created']
+
+    def test_get_categories(self):
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(len(data['categories']))
+
+    def test_get_questions_paginated(self):
+        res = self.client().get('/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['questions']), min(10, data['total_questions']))
+        self.assertTrue(len(data['categories']))
+
+    def test_pages_and_cursors_agree(self):
+        first = json.loads(self.client().get('/questions?limit=2').data)
+        by_page = json.loads(self.client().get('/questions?limit=2&page=2').data)
+        by_cursor = json.loads(self.client().get('/questions?limit=2&after={}'.format(first['next_cursor'])).data)
+
+        self.assertEqual(by_page['questions'], by_cursor['questions'])
+        self.assertNotEqual(first['questions'], by_page['questions'])
+
+    def test_400_malformed_cursor(self):
+        res = self.client().get('/questions?after=abc')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_404_page_past_the_end(self):
+        res = self.client().get('/questions?page=1000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_get_category_questions(self):
+        res = self.client().get('/categories/1/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['current_category'], 'Science')
+        self.assertTrue(all(str(q['category']) == '1' for q in data['questions']))
+
+    def test_404_unknown_category(self):
+        res = self.client().get('/categories/1000/questions')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_create_and_delete_question(self):
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+        question_id = self.create_question()
+        self.assertEqual(json.loads(self.client().get('/questions').data)['total_questions'], total + 1)
+
+        res = self.client().delete('/questions/{}'.format(question_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], question_id)
+        self.assertEqual(json.loads(self.client().get('/questions').data)['total_questions'], total)
+
+    def test_question_without_category_is_counted_once(self):
+        with self.app.app_context():
+            question = Question(question='Q', answer='A', category=None, difficulty=1)
+            question.insert()
+            question_id = question.id
+            total = Question.query.count()
+        data = json.loads(self.client().get('/questions').data)
+        self.client().delete('/questions/{}'.format(question_id))
+
+        self.assertEqual(data['total_questions'], total)
+
+    def test_422_create_question_in_unknown_category(self):
+        res = self.client().post('/questions', json={
+            'question': 'Q', 'answer': 'A', 'category': 1000, 'difficulty': 1
+        })
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_404_delete_missing_question(self):
+        res = self.client().delete('/questions/1000000')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_search_questions(self):
+        res = self.client().post('/questions', json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['questions'])
+        self.assertEqual(data['total_questions'], len(data['questions']))
+        for question in data['questions']:
+            self.assertIn('title', question['question'].lower())
+
+    def test_search_matches_words_not_substrings(self):
+        title = json.loads(self.client().post('/questions', json={'searchTerm': 'title'}).data)
+        entitled = json.loads(self.client().post('/questions', json={'searchTerm': 'autobiography ent'}).data)
+
+        self.assertNotIn('entitled', ' '.join(q['question'] for q in title['questions']))
+        self.assertEqual(entitled['total_questions'], 1)
+        self.assertIn('entitled', entitled['questions'][0]['question'])
+
+    def test_search_finds_new_question_by_prefix_in_category(self):
+        question_id = self.create_question(category=2)
+        res = self.client().post('/questions', json={'searchTerm': 'which test wro', 'category': 2})
+        data = json.loads(res.data)
+        self.client().delete('/questions/{}'.format(question_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['current_category'], 'Art')
+        self.assertIn(question_id, [q['id'] for q in data['questions']])
+        after = json.loads(self.client().post('/questions', json={'searchTerm': 'which test wro'}).data)
+        self.assertNotIn(question_id, [q['id'] for q in after['questions']])
+
+    def test_404_search_in_unknown_category(self):
+        res = self.client().post('/questions', json={'searchTerm': 'title', 'category': 1000})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_import_questions_skips_duplicates_and_invalid_rows(self):
+        existing = json.loads(self.client().get('/questions').data)['questions'][0]
+        body = '\n'.join([
+            'question,answer,category,difficulty',
+            '"{}",again,1,1'.format(existing['question'].upper()),
+            'Which test imported this question?,test_flaskr,Science,2',
+            'Which category is this?,none,1000,2',
+            'How hard is this?,too,1,9',
+        ])
+        res = self.client().post('/questions/import', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+        found = json.loads(self.client().post('/questions', json={'searchTerm': 'which test imported'}).data)
+        for question in found['questions']:
+            self.client().delete('/questions/{}'.format(question['id']))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['read'], 4)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['duplicates'], 1)
+        self.assertEqual(data['invalid'], 2)
+        self.assertEqual(found['total_questions'], 1)
+
+    def test_import_questions_skips_bank_duplicates_by_normalized_text(self):
+        created = json.loads(self.client().post('/questions', json={
+            'question': 'What is 2+2 in the import test?', 'answer': '4', 'category': 1, 'difficulty': 1}).data)
+        body = 'question,answer,category,difficulty\n"what is 2 + 2, in the  import test",4,1,1\n'
+        res = self.client().post('/questions/import', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+        self.client().delete('/questions/{}'.format(created['created']))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 0)
+        self.assertEqual(data['duplicates'], 1)
+
+    def test_400_import_questions_of_unknown_format(self):
+        res = self.client().post('/questions/import', data='questions', content_type='text/plain')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_quiz_question_in_category_not_asked_before(self):
+        ids = [q['id'] for q in json.loads(self.client().get('/categories/1/questions').data)['questions']]
+        res = self.client().post('/quizzes', json={
+            'previous_questions': ids[:-1],
+            'quiz_category': {'type': 'Science', 'id': 1}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], ids[-1])
+
+    def test_quiz_ends_when_category_is_exhausted(self):
+        ids = [q['id'] for q in json.loads(self.client().get('/categories/1/questions').data)['questions']]
+        res = self.client().post('/quizzes', json={
+            'previous_questions': ids,
+            'quiz_category': {'type': 'Science', 'id': 1}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(data['question'])
+
+    def test_404_quiz_in_unknown_category(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'type': 'Nope', 'id': 1000}
+        })
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_quiz_session_asks_every_question_once(self):
+        ids = [q['id'] for q in json.loads(self.client().get('/categories/1/questions').data)['questions']]
+        res = self.client().post('/quizzes/sessions', json={'quiz_category': {'type': 'Science', 'id': 1}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        session_id = data['session_id']
+        asked = [data['question']['id']]
+        for i in range(len(ids)):
+            data = json.loads(self.client().post('/quizzes/sessions/' + session_id).data)
+            if data['question'] is None:
+                break
+            asked.append(data['question']['id'])
+
+        self.assertEqual(sorted(asked), sorted(ids))
+        self.assertIsNone(data['question'])
+
+    def test_404_quiz_session_after_it_ended(self):
+        session_id = json.loads(self.client().post('/quizzes/sessions', json={}).data)['session_id']
+        res = self.client().delete('/quizzes/sessions/' + session_id)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.client().post('/quizzes/sessions/' + session_id).status_code, 404)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -1,15 +1,19 @@
 import os
+import base64
 from flask import Flask, request, jsonify, abort
 from sqlalchemy import exc
 import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
+from .database.models import db_drop_and_create_all, setup_db, decode_recipe, read_session, Drink, MenuVersion
 from .auth.auth import AuthError, requires_auth
+from .menu_cache import MenuCache
+from .flask_metrics import Metrics
 
 app = Flask(__name__)
 setup_db(app)
 CORS(app)
+metrics = Metrics(app)
 
 '''
 @TODO uncomment the following line to initialize the datbase
@@ -25,7 +29,9 @@ https://fsnd-stefan.auth0.com/authorize?audience=coffee-shop&response_type=token
 '''
 
 def get_title_and_recipe(request):
-    body = request.get_json()
+    return title_and_recipe_from(request.get_json())
+
+def title_and_recipe_from(body):
     title = body['title'] if 'title' in body else None
     recipe = json.dumps(body['recipe']) if 'recipe' in body else None
 
@@ -34,6 +40,101 @@ def get_title_and_recipe(request):
     
     return title, recipe
 
+'''
+listing parameters for GET /drinks and GET /drinks-detail
+    ?limit=     page size, at most MAX_DRINKS_PER_PAGE; without it every drink is returned
+    ?cursor=    the next_cursor of the previous page (keyset on title, id)
+    ?fields=    comma separated subset of DRINK_FIELDS (ex: fields=id,title skips the recipe)
+'''
+DRINK_FIELDS = ('id', 'title', 'recipe')
+MAX_DRINKS_PER_PAGE = 100
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row.title, row.id]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        title, drink_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        abort(400)
+    if not isinstance(drink_id, int):
+        abort(400)
+    return title, drink_id
+
+def get_listing_args(request):
+    fields = DRINK_FIELDS
+    if 'fields' in request.args:
+        requested = set(request.args['fields'].split(','))
+        if not requested <= set(DRINK_FIELDS):
+            abort(400)
+        fields = tuple(f for f in DRINK_FIELDS if f in requested)
+
+    limit = None
+    if 'limit' in request.args:
+        try:
+            limit = int(request.args['limit'])
+        except ValueError:
+            abort(400)
+        if not 0 < limit <= MAX_DRINKS_PER_PAGE:
+            abort(400)
+
+    after = None
+    if 'cursor' in request.args:
+        after = decode_cursor(request.args['cursor'])
+
+    return fields, after, limit
+
+'''
+menu_cache holds the serialized /drinks and /drinks-detail bodies
+    they are tied to the menu version in the database (MenuVersion), which
+    add_drink, update_drink, delete_drink and the bulk import bump
+'''
+menu_cache = MenuCache()
+
+def cached_menu_response(name, short):
+    '''
+    @param name the listing the body is cached under
+    @param short true for the drink.short() recipe, false for drink.long()
+    @return the listing, or a 304 when the client's If-None-Match already matches
+    '''
+    fields, after, limit = get_listing_args(request)
+    key = '{}?fields={}&cursor={}&limit={}'.format(
+        name, ','.join(fields), request.args.get('cursor', ''), limit)
+
+    version = MenuVersion.current(read_session)
+    entry = menu_cache.get(key, version)
+    if entry is None:
+        # one extra row tells whether there is a next page
+        rows = Drink.listing(fields, after=after, limit=None if limit is None else limit + 1, session=read_session)
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit]
+
+        if len(rows) == 0 and after is None:
+            abort(404)
+
+        drinks = []
+        for row in rows:
+            drink = {}
+            for field in fields:
+                if field == 'recipe':
+                    drink['recipe'] = decode_recipe(row.recipe)[1 if short else 0]
+                else:
+                    drink[field] = getattr(row, field)
+            drinks.append(drink)
+
+        result = {
+            'success': True,
+            'drinks': drinks,
+        }
+        if limit is not None:
+            result['next_cursor'] = encode_cursor(rows[-1]) if has_more else None
+
+        entry = menu_cache.put(key, version, json.dumps(result))
+
+    response = app.response_class(entry['body'], mimetype='application/json')
+    response.set_etag(entry['etag'])
+    return response.make_conditional(request)
+
 
 ## ROUTES
 '''
@@ -43,20 +144,12 @@ def get_title_and_recipe(request):
         it should contain only the drink.short() data representation
     returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
         or appropriate status code indicating reason for failure
+    accepts the ?limit=, ?cursor= and ?fields= listing parameters,
+        with ?limit= the json also carries "next_cursor" (null on the last page)
 '''
 @app.route('/drinks')
 def get_drinks():
-    drinks = Drink.query.order_by(Drink.title).all()
-
-    if len(drinks) == 0:
-        abort(404)
-
-    formatted_drinks = [d.short() for d in drinks]
-
-    return jsonify({
-        'success': True,
-        'drinks' : formatted_drinks,
-    })
+    return cached_menu_response('drinks', short=True)
 
 '''
 @TODO implement endpoint
@@ -65,22 +158,13 @@ def get_drinks():
         it should contain the drink.long() data representation
     returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
         or appropriate status code indicating reason for failure
+    accepts the same listing parameters as GET /drinks
 '''
 
 @app.route('/drinks-detail')
 @requires_auth('get:drinks-detail')
 def get_drinks_detail():
-    drinks = Drink.query.order_by(Drink.title).all()
-
-    if len(drinks) == 0:
-        abort(404)
-
-    formatted_drinks = [d.long() for d in drinks]
-
-    return jsonify({
-        'success': True,
-        'drinks' : formatted_drinks,
-    })
+    return cached_menu_response('drinks-detail', short=False)
 
 '''
 @TODO implement endpoint
@@ -102,6 +186,7 @@ def add_drink():
             recipe=recipe
         )
         new_drink.insert()
+        MenuVersion.bump()
 
     except:
         abort(422)
@@ -113,6 +198,107 @@ def add_drink():
 
 
 
+'''
+bulk import
+    items are validated like POST /drinks, and additionally need a title and
+    a recipe whose ingredients carry a color and parts, since the upsert is
+    matched on title and the listings need both
+'''
+BULK_BATCH_SIZE = 500
+
+def validate_bulk_item(item):
+    if not isinstance(item, dict):
+        raise ValueError('expected a json object')
+    title, recipe = title_and_recipe_from(item)
+    if not title or not isinstance(title, str):
+        raise ValueError('title is required')
+    if not recipe:
+        raise ValueError('recipe is required')
+    for ingredient in json.loads(recipe):
+        if not isinstance(ingredient, dict) or 'color' not in ingredient or 'parts' not in ingredient:
+            raise ValueError('every ingredient needs a color and parts')
+    return title, recipe
+
+def get_bulk_items(request):
+    '''
+    yields (index, item or None, error message or None) for each submitted drink
+    a json array is parsed whole, application/x-ndjson is read line by line
+    '''
+    if request.mimetype == 'application/x-ndjson':
+        index = 0
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                yield index, json.loads(line), None
+            except ValueError:
+                yield index, None, 'invalid json'
+            index += 1
+        return
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, list):
+        abort(400)
+    for index, item in enumerate(body):
+        yield index, item, None
+
+'''
+    POST /drinks/bulk
+        upserts many drinks at once, matched on title
+        it should require the 'post:drinks' permission
+        the body is a json array of drinks, or one drink per line with
+            the application/x-ndjson content type
+        drinks are written in batches of BULK_BATCH_SIZE, one transaction per batch
+    returns status code 200 and json {"success": True, "inserted": n, "updated": n, "errors": errors}
+        where errors lists {"index": i, "message": reason} for every drink that was not written
+'''
+@app.route('/drinks/bulk', methods=['POST'])
+@requires_auth('post:drinks')
+def bulk_upsert_drinks():
+    inserted = updated = 0
+    errors = []
+    batch = {}
+
+    def flush():
+        nonlocal inserted, updated
+        indexes = [index for index, recipe in batch.values()]
+        try:
+            counts = Drink.bulk_upsert([(title, recipe) for title, (index, recipe) in batch.items()])
+        except exc.SQLAlchemyError:
+            errors.extend({'index': index, 'message': 'could not be saved'} for index in indexes)
+        else:
+            inserted += counts[0]
+            updated += counts[1]
+            MenuVersion.bump()
+        batch.clear()
+
+    for index, item, error in get_bulk_items(request):
+        if error is None:
+            try:
+                title, recipe = validate_bulk_item(item)
+            except (ValueError, TypeError, KeyError) as e:
+                error = str(e) or 'invalid drink'
+        if error is not None:
+            errors.append({'index': index, 'message': error})
+            continue
+
+        # a title repeated within the batch keeps its last recipe
+        batch.pop(title, None)
+        batch[title] = (index, recipe)
+        if len(batch) >= BULK_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+    errors.sort(key=lambda e: e['index'])
+    return jsonify({
+        'success': True,
+        'inserted': inserted,
+        'updated': updated,
+        'errors': errors,
+    })
+
+
 '''
 @TODO implement endpoint
     PATCH /drinks/<id>
@@ -139,6 +325,7 @@ def update_drink(drink_id):
             drink.recipe = recipe
         
         drink.update()
+        MenuVersion.bump()
 
     except:
         abort(422)
@@ -166,6 +353,7 @@ def delete_drink(drink_id):
         if drink is None:
             abort(404)
         drink.delete()
+        MenuVersion.bump()
     except:
         abort(422)
     
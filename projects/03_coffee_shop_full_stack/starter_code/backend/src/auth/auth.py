@@ -1,13 +1,35 @@
-import json
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from .jwks import JWKSCache, url_fetcher
+from .permissions import any_of, all_of, compile_permissions, granted_permissions
+from .token_cache import VerifiedTokenCache
 
 
 AUTH0_DOMAIN = 'fsnd-stefan.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'coffee-shop'
+JWKS_URL = "https://"+AUTH0_DOMAIN+"/.well-known/jwks.json"
+
+# seconds the signing keys are served without revalidation,
+# how long past that stale keys are still accepted while refreshing,
+# and the minimum gap between refetches forced by an unknown kid
+JWKS_CACHE_TTL = 600
+JWKS_MAX_STALE = 3600
+JWKS_MIN_REFETCH_INTERVAL = 30
+
+jwks_cache = JWKSCache(
+    url_fetcher(JWKS_URL),
+    ttl=JWKS_CACHE_TTL,
+    max_stale=JWKS_MAX_STALE,
+    min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL
+)
+
+# number of verified tokens kept so repeat bearer tokens skip RS256 verification
+TOKEN_CACHE_SIZE = 1024
+
+token_cache = VerifiedTokenCache(maxsize=TOKEN_CACHE_SIZE)
 
 ## AuthError Exception
 '''
@@ -54,11 +76,14 @@ def get_token_auth_header():
     token = parts[1]
     return token
 
-def check_permissions(permission, payload):
+def check_permissions(permission, payload, granted=None):
     '''
     Checks that the permissions inside of the payload are authorized
-    @param string permission (ex: 'post:drink')
+    @param permission string permission (ex: 'post:drink') or a compiled
+        expression (ex: any_of('patch:drinks', 'delete:drinks'))
     @payload decoded jwt payload
+    @granted the payload permissions already run through granted_permissions,
+        computed here when not given
     @return true of permission is valid, otherwise raise an AuthError 
     '''
     if 'permissions' not in payload:
@@ -66,35 +91,49 @@ def check_permissions(permission, payload):
             'code': 'invalid_claims',
             'description': 'Permissions not incluced in JWT'
         }, 400)
-    if permission not in payload['permissions']:
+    if granted is None:
+        granted = granted_permissions(payload['permissions'])
+    if not compile_permissions(permission).allows(granted):
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found'
         }, 403)
     return True
 
+def configure_jwks(fetcher=None, **options):
+    '''
+    Replaces the process-wide jwks cache
+    @param fetcher callable returning the jwks document, defaults to fetching JWKS_URL
+        (ex: jwks.file_fetcher('jwks.json') to test against a local stand-in)
+    @param options ttl, max_stale, min_refetch_interval or clock overrides
+    @return the new cache
+    '''
+    global jwks_cache
+    options.setdefault('ttl', JWKS_CACHE_TTL)
+    options.setdefault('max_stale', JWKS_MAX_STALE)
+    options.setdefault('min_refetch_interval', JWKS_MIN_REFETCH_INTERVAL)
+    jwks_cache = JWKSCache(fetcher or url_fetcher(JWKS_URL), **options)
+    return jwks_cache
+
 '''
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 def verify_decode_jwt(token):
     '''
     Verify that the the jwt token is a valid token
+    the signing keys come from the process-wide jwks cache instead of
+    being downloaded for every request
     @param token a json web token (string)
     @return decoded payload as a dictionary
     '''
-    jsonurl = urlopen("https://"+AUTH0_DOMAIN+"/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"]
-            }
+    if 'kid' not in unverified_header:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization malformed.'
+        }, 401)
+
+    rsa_key = jwks_cache.get_key(unverified_header["kid"])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -126,28 +165,40 @@ def verify_decode_jwt(token):
 
 def requires_auth(permission=''):
     '''
-    @param permission string permission (ex: 'post:drink')
+    @param permission string permission (ex: 'post:drink'), an expression from
+        any_of / all_of, or a list of permissions that are all required
 
+    the permission is compiled once here, not on every request
     it should use the get_token_auth_header method to get the token
-    it should use the verify_decode_jwt method to decode the jwt
+    it should use the verify_decode_jwt method to decode the jwt,
+        unless token_cache already holds the verified payload for this token
     it should use the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
     '''
+    required = compile_permissions(permission)
+
     def requires_auth_decorator(f):
         """Determines if the Access Token is valid
         """
         @wraps(f)
         def decorated(*args, **kwargs):
             token = get_token_auth_header()
-            try:
-                payload = verify_decode_jwt(token)
-            except:
-                raise AuthError({
-                'code' : 'unauthorized',
-                'description' : 'could not process token'
-            }, 401)
-
-            check_permissions(permission, payload)
+            entry = token_cache.get(token)
+            if entry is None:
+                try:
+                    payload = verify_decode_jwt(token)
+                except:
+                    raise AuthError({
+                    'code' : 'unauthorized',
+                    'description' : 'could not process token'
+                }, 401)
+                entry = token_cache.put(
+                    token,
+                    payload,
+                    permissions=granted_permissions(payload.get('permissions', []))
+                )
+
+            check_permissions(required, entry['payload'], entry['permissions'])
             
             return f(*args, **kwargs)
            
@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+'''
+JWKS fetchers
+    a fetcher is any callable taking no arguments and returning the parsed
+    jwks document ({"keys": [...]}). the cache below only ever talks to a fetcher,
+    so a local stand-in file can replace the identity provider in tests
+'''
+def url_fetcher(url):
+    def fetch():
+        jsonurl = urlopen(url)
+        return json.loads(jsonurl.read())
+    return fetch
+
+def file_fetcher(path):
+    def fetch():
+        with open(path) as jwks_file:
+            return json.load(jwks_file)
+    return fetch
+
+
+'''
+JWKSCache
+    process-wide store of the identity provider's signing keys, keyed by kid
+    - the first lookup blocks on a fetch, later lookups are served from memory
+    - once the keys are older than ttl they are still served while a single
+      background thread refreshes them (stale-while-revalidate)
+    - past ttl + max_stale the stale keys are no longer trusted and the lookup
+      blocks on a refresh again
+    - an unknown kid forces a refetch (key rotation), at most once every
+      min_refetch_interval seconds so garbage tokens cannot hammer the provider,
+      and not when the keys were fetched during the same lookup
+    - fetches run one at a time: concurrent lookups that find the keys missing
+      or expired wait for a single fetch instead of each starting their own
+'''
+class JWKSCache:
+    def __init__(self, fetcher, ttl=600, max_stale=3600, min_refetch_interval=30, clock=time.monotonic):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.min_refetch_interval = min_refetch_interval
+        self.clock = clock
+
+        self._keys = {}
+        self._fetched_at = None
+        self._last_forced_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    '''
+    get_key(kid)
+        @param kid the key id from the unverified jwt header
+        @return the rsa key dict for kid, or None if the provider does not know it
+    '''
+    def get_key(self, kid):
+        now = self.clock()
+        fetched_at = self._fetched_at
+
+        if fetched_at is None or now - fetched_at >= self.ttl + self.max_stale:
+            self._refresh_unless_fetched_since(fetched_at)
+        elif now - fetched_at >= self.ttl:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._fetched_at == fetched_at and self._may_force_refetch(now):
+            self._refresh_unless_fetched_since(fetched_at)
+            key = self._keys.get(kid)
+        return key
+
+    '''
+    refresh()
+        fetches the jwks synchronously and swaps in the new key map
+        fetch errors propagate to the caller, the previous keys are kept
+    '''
+    def refresh(self):
+        with self._fetch_lock:
+            self._fetch()
+
+    def _refresh_unless_fetched_since(self, fetched_at):
+        # another lookup may have fetched while this one waited for the lock
+        with self._fetch_lock:
+            if self._fetched_at == fetched_at:
+                self._fetch()
+
+    def _fetch(self):
+        jwks = self.fetcher()
+        keys = {}
+        for key in jwks["keys"]:
+            keys[key["kid"]] = {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key["use"],
+                "n": key["n"],
+                "e": key["e"]
+            }
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = self.clock()
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_forced_at = None
+
+    def _may_force_refetch(self, now):
+        with self._lock:
+            if self._last_forced_at is not None and now - self._last_forced_at < self.min_refetch_interval:
+                return False
+            self._last_forced_at = now
+            return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                # keep serving the stale keys, the next lookup past ttl retries
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,75 @@
+'''
+Permission expressions
+    requires_auth accepts a plain permission string or an expression built here,
+    compiled once at decoration time:
+        requires_auth('get:drinks-detail')
+        requires_auth(any_of('patch:drinks', 'delete:drinks'))
+        requires_auth(all_of('get:drinks-detail', 'post:drinks'))
+    a granted scope may use '*' for any segment: a token granted 'post:*',
+    '*:drinks' or '*:*' satisfies a requirement of 'post:drinks'. each required
+    permission is compiled into the set of scopes that grant it, and the token's
+    permissions are turned into a frozenset once, so a check is one frozenset
+    lookup per required permission
+'''
+WILDCARD = '*'
+
+
+'''
+granting_scopes(permission)
+    @param permission a required permission (ex: 'post:drinks')
+    @return frozenset of the permission and every wildcard form of it
+        (ex: 'post:drinks', 'post:*', '*:drinks' and '*:*')
+'''
+def granting_scopes(permission):
+    forms = ['']
+    for i, part in enumerate(permission.split(':')):
+        sep = ':' if i else ''
+        forms = [f + sep + p for f in forms for p in (part, WILDCARD)]
+    return frozenset(forms)
+
+
+class PermissionExpression:
+    def __init__(self, mode, permissions):
+        self.mode = mode
+        self.permissions = tuple(permissions)
+        self.required = tuple(granting_scopes(p) for p in self.permissions)
+
+    '''
+    allows(granted)
+        @param granted frozenset returned by granted_permissions
+        @return true if the granted permissions satisfy the expression
+    '''
+    def allows(self, granted):
+        check = any if self.mode == 'any' else all
+        return check(not scopes.isdisjoint(granted) for scopes in self.required)
+
+    def __repr__(self):
+        return '{}_of({})'.format(self.mode, ', '.join(sorted(self.permissions)))
+
+
+def any_of(*permissions):
+    return PermissionExpression('any', permissions)
+
+def all_of(*permissions):
+    return PermissionExpression('all', permissions)
+
+'''
+compile_permissions(permission)
+    @param permission a permission string, an expression from any_of / all_of,
+        or an iterable of permission strings (treated as all_of)
+    @return a PermissionExpression
+'''
+def compile_permissions(permission):
+    if isinstance(permission, PermissionExpression):
+        return permission
+    if isinstance(permission, str):
+        return all_of(permission)
+    return all_of(*permission)
+
+'''
+granted_permissions(permissions)
+    @param permissions the list from the jwt payload (ex: ['get:drinks-detail', 'post:*'])
+    @return frozenset of the permissions, built once per verified token
+'''
+def granted_permissions(permissions):
+    return frozenset(permissions)
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+'''
+VerifiedTokenCache
+    bounded LRU of tokens that already passed RS256 verification
+    - entries are keyed by a sha256 of the token so raw bearer tokens are never held
+    - an entry expires at the token's own exp claim, after that the token
+      goes through full verification again (and fails as expired)
+    - hits and misses are counted so the hit rate can be monitored
+'''
+class VerifiedTokenCache:
+    def __init__(self, maxsize=1024, clock=time.time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    '''
+    get(token)
+        @param token a json web token (string)
+        @return the cached entry for token, or None if it is unknown or expired
+    '''
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] <= self.clock():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    '''
+    put(token, payload, **extra)
+        @param token a json web token (string)
+        @param payload the verified, decoded payload of token
+        @param extra values derived from the payload to keep alongside it
+        @return the entry, only stored if the token carries an exp claim
+    '''
+    def put(self, token, payload, **extra):
+        entry = dict(extra, payload=payload, expires_at=payload.get('exp'))
+        if entry['expires_at'] is None:
+            return entry
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
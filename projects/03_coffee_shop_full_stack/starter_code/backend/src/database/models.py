@@ -1,5 +1,9 @@
 import os
-from sqlalchemy import Column, String, Integer
+from functools import lru_cache
+from sqlalchemy import Column, String, Integer, and_, or_, bindparam, create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import reconstructor, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -7,8 +11,35 @@ database_filename = "database_test.db"
 project_dir = os.path.dirname(os.path.abspath(__file__))
 database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filename))
 
+'''
+sqlite_profile
+    pragmas applied to every new sqlite connection, and the size of the
+    read-only connection pool used by the GET routes
+    - journal_mode WAL lets readers run alongside the single writer
+    - synchronous NORMAL only fsyncs at wal checkpoints, which is safe in WAL mode
+    - busy_timeout (ms) makes a locked database wait instead of failing right away
+    - cache_size is in pages, or KiB when negative
+    set it to None before setup_db to keep sqlite's defaults
+'''
+sqlite_profile = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,
+    'read_pool_size': 5,
+}
+
 db = SQLAlchemy()
 
+'''
+read_session
+    session for queries that never write (ex: the drink listings)
+    bound to a pool of query_only sqlite connections by setup_db,
+    or to the main engine when the profile is off or the database is not a sqlite file
+'''
+read_session = scoped_session(sessionmaker())
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
@@ -19,6 +50,41 @@ def setup_db(app):
     db.app = app
     db.init_app(app)
 
+    engine = db.get_engine(app)
+    read_engine = engine
+    if sqlite_profile is not None and engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', sqlite_pragmas(sqlite_profile))
+        if engine.url.database not in (None, '', ':memory:'):
+            read_engine = create_engine(
+                engine.url,
+                poolclass=QueuePool,
+                pool_size=sqlite_profile['read_pool_size'],
+                connect_args={'check_same_thread': False}
+            )
+            event.listen(read_engine, 'connect', sqlite_pragmas(sqlite_profile, query_only=True))
+
+    read_session.configure(bind=read_engine)
+    app.teardown_appcontext(lambda exception: read_session.remove())
+    create_menu_version(engine)
+
+'''
+sqlite_pragmas(profile, query_only=False)
+    @return a connect event listener applying the profile's pragmas
+'''
+def sqlite_pragmas(profile, query_only=False):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not query_only:
+            cursor.execute('PRAGMA journal_mode={}'.format(profile['journal_mode']))
+        cursor.execute('PRAGMA synchronous={}'.format(profile['synchronous']))
+        cursor.execute('PRAGMA busy_timeout={:d}'.format(profile['busy_timeout']))
+        cursor.execute('PRAGMA mmap_size={:d}'.format(profile['mmap_size']))
+        cursor.execute('PRAGMA cache_size={:d}'.format(profile['cache_size']))
+        if query_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+    return on_connect
+
 '''
 db_drop_and_create_all()
     drops the database tables and starts fresh
@@ -29,6 +95,23 @@ def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
 
+'''
+decode_recipe(recipe)
+    parses a recipe blob into its long and short form lists
+    memoized on the raw string, so a drink loaded again by a later request
+    does not pay for json.loads again
+    the returned lists are shared, treat them as read-only
+'''
+@lru_cache(maxsize=1024)
+def decode_recipe(recipe):
+    long_recipe = json.loads(recipe)
+    short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in long_recipe]
+    return long_recipe, short_recipe
+
+def copy_representation(representation):
+    # callers get their own dict, recipe list and parts, the cached ones stay intact
+    return dict(representation, recipe=[dict(part) for part in representation['recipe']])
+
 '''
 Drink
 a persistent drink entity, extends the base SQLAlchemy Model
@@ -42,29 +125,104 @@ class Drink(db.Model):
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
     recipe =  Column(String(180), nullable=False)
 
+    '''
+    init_representations()
+        runs when the row is loaded from the database
+        short() and long() are built once and reused until the drink changes;
+        each call returns a copy
+    '''
+    @reconstructor
+    def init_representations(self):
+        self._representations = None
+
+    def _get_representations(self):
+        state = (self.id, self.title, self.recipe)
+        cached = getattr(self, '_representations', None)
+        if cached is None or cached[0] != state:
+            long_recipe, short_recipe = decode_recipe(self.recipe)
+            cached = (state, {
+                'id': self.id,
+                'title': self.title,
+                'recipe': short_recipe
+            }, {
+                'id': self.id,
+                'title': self.title,
+                'recipe': long_recipe
+            })
+            self._representations = cached
+        return cached
+
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        # print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
-        return {
-            'id': self.id,
-            'title': self.title,
-            'recipe': short_recipe
-        }
+        return copy_representation(self._get_representations()[1])
 
     '''
     long()
         long form representation of the Drink model
     '''
     def long(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'recipe': json.loads(self.recipe)
-        }
+        return copy_representation(self._get_representations()[2])
+
+    '''
+    listing(fields, after=None, limit=None, session=None)
+        a page of drinks ordered by (title, id), loading only the requested columns
+        @param fields column names to select (ex: ('id', 'title'))
+            id and title are always selected since the next cursor is built from them
+        @param after (title, id) of the last row on the previous page
+        @param limit maximum number of rows, None for every remaining row
+        @param session the session to query with, defaults to db.session (ex: read_session)
+        @return list of rows with the selected columns as attributes
+    '''
+    @classmethod
+    def listing(cls, fields, after=None, limit=None, session=None):
+        session = session or db.session
+        names = ['id', 'title'] + [f for f in fields if f not in ('id', 'title')]
+        query = session.query(*[getattr(cls, name) for name in names]).order_by(cls.title, cls.id)
+        if after is not None:
+            title, drink_id = after
+            query = query.filter(or_(
+                cls.title > title,
+                and_(cls.title == title, cls.id > drink_id)
+            ))
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    '''
+    bulk_upsert(items)
+        inserts or updates a batch of drinks, matched on their unique title,
+        with one executemany per statement and a single commit
+        @param items list of (title, recipe) pairs, titles must be distinct
+        @return (inserted, updated) counts
+        EXAMPLE
+            Drink.bulk_upsert([('Latte', '[{"name": "milk", "color": "white", "parts": 2}]')])
+    '''
+    @classmethod
+    def bulk_upsert(cls, items):
+        titles = [title for title, recipe in items]
+        existing = set(t for (t,) in db.session.query(cls.title).filter(cls.title.in_(titles)))
+
+        inserts = [{'title': t, 'recipe': r} for t, r in items if t not in existing]
+        updates = [{'b_title': t, 'b_recipe': r} for t, r in items if t in existing]
+
+        try:
+            if inserts:
+                db.session.execute(cls.__table__.insert(), inserts)
+            if updates:
+                db.session.execute(
+                    cls.__table__.update()
+                        .where(cls.title == bindparam('b_title'))
+                        .values(recipe=bindparam('b_recipe')),
+                    updates
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(inserts), len(updates)
 
     '''
     insert()
@@ -102,6 +260,53 @@ class Drink(db.Model):
     '''
     def update(self):
         db.session.commit()
+        self._representations = None
 
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps(self.short())
+
+'''
+MenuVersion
+    a single row counting the changes to the drinks, in the database so that
+    every worker process sees the same count (see menu_cache.py)
+'''
+class MenuVersion(db.Model):
+    __tablename__ = 'menu_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+    '''
+    current(session)
+        @param session the session to read with (ex: read_session)
+        @return the current menu version
+    '''
+    @classmethod
+    def current(cls, session):
+        return session.query(cls.version).filter(cls.id == 1).scalar() or 0
+
+    '''
+    bump()
+        counts one change to the drinks, in its own transaction
+    '''
+    @classmethod
+    def bump(cls):
+        db.session.query(cls).filter(cls.id == 1) \
+            .update({cls.version: cls.version + 1}, synchronize_session=False)
+        db.session.commit()
+
+@event.listens_for(MenuVersion.__table__, 'after_create')
+def insert_menu_version(target, connection, **kw):
+    connection.execute(target.insert(), id=1, version=0)
+
+'''
+create_menu_version(engine)
+    adds the menu_version table to a database made before it
+'''
+def create_menu_version(engine):
+    try:
+        with engine.begin() as connection:
+            MenuVersion.__table__.create(connection, checkfirst=True)
+    except OperationalError:
+        # created by another worker starting at the same time
+        pass
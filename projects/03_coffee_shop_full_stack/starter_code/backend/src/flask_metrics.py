@@ -0,0 +1,220 @@
+'''
+Request and SQL metrics for the Flask apps of this repository, exposed in
+the Prometheus text format.
+
+Each app has its own copy of this file next to its code, so every project
+runs on its own; the copies are identical and are changed together:
+
+    from flask_metrics import Metrics
+    metrics = Metrics(app)
+
+For every endpoint it records
+    - a latency histogram of the requests, by method and status
+    - a histogram of the SQL statements issued per request
+    - the time spent executing them
+    - how often a request ran one statement more than
+      METRICS_N_PLUS_ONE_THRESHOLD times, the mark of an N+1 query pattern;
+      those requests are also logged as warnings with the statement
+and serves them on METRICS_PATH (default /metrics).
+
+Statements are counted from the engine events of every SQLAlchemy engine in
+the process and attributed to the request being served on that thread. The
+engine hooks are registered once, when this module is imported, however many
+apps are created; request_sql_stats() gives other code (ex: request logs)
+the same numbers without timing the statements again.
+Numbers are kept per process: with several worker processes each one
+reports its own.
+'''
+import re
+import threading
+import time
+from collections import Counter
+from flask import Response, current_app, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# literals and bound parameter lists vary between otherwise identical statements
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PARAMETER_LIST = re.compile(r'\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)')
+SPACES = re.compile(r'\s+')
+
+
+def normalize_statement(statement):
+    statement = LITERAL.sub('?', statement)
+    statement = PARAMETER_LIST.sub('(?)', statement)
+    return SPACES.sub(' ', statement).strip()
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    return ','.join('{}="{}"'.format(name, escape_label(value)) for name, value in labels)
+
+
+class SqlStats:
+    '''Statements run while serving one request, and the time they took.'''
+
+    def __init__(self):
+        self.statements = Counter()
+        self.seconds = 0.0
+
+    @property
+    def queries(self):
+        return sum(self.statements.values())
+
+
+def request_sql_stats():
+    '''SqlStats of the request being served, kept in its WSGI environ.'''
+    stats = request.environ.get('flask_metrics.sql')
+    if stats is None:
+        stats = request.environ['flask_metrics.sql'] = SqlStats()
+    return stats
+
+
+# the start time is kept on the statement's execution context, which is
+# discarded with it when the statement fails
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context():
+        context._flask_metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_flask_metrics_started', None)
+    if started is not None and has_request_context():
+        stats = request_sql_stats()
+        stats.seconds += time.perf_counter() - started
+        stats.statements[statement] += 1
+
+
+class Histogram:
+    '''Cumulative buckets, sum and count per label set.'''
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append('{}_bucket{{{}}} {}'.format(
+                    self.name, format_labels(labels + (('le', repr(float(bound))),)), cumulative))
+            lines.append('{}_bucket{{{}}} {}'.format(self.name, format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, format_labels(labels), repr(total)))
+            lines.append('{}_count{{{}}} {}'.format(self.name, format_labels(labels), count))
+        return lines
+
+
+class CounterMetric:
+    '''Monotonic totals per label set.'''
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.series = Counter()
+
+    def inc(self, labels, value=1):
+        self.series[labels] += value
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        for labels, value in sorted(self.series.items()):
+            lines.append('{}{{{}}} {}'.format(self.name, format_labels(labels), repr(value)))
+        return lines
+
+
+class Metrics:
+    '''
+    Configured from the app:
+        METRICS_PATH                  route of the exposition endpoint, None to skip it
+        METRICS_N_PLUS_ONE_THRESHOLD  repeats of one statement flagged as N+1
+    '''
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self.latency = Histogram(
+            'http_request_duration_seconds', 'Request latency by endpoint.', LATENCY_BUCKETS)
+        self.query_counts = Histogram(
+            'db_queries_per_request', 'SQL statements issued per request.', QUERY_COUNT_BUCKETS)
+        self.query_seconds = CounterMetric(
+            'db_query_duration_seconds_total', 'Time spent executing SQL statements.')
+        self.queries = CounterMetric(
+            'db_queries_total', 'SQL statements executed.')
+        self.n_plus_one = CounterMetric(
+            'db_n_plus_one_requests_total', 'Requests repeating one SQL statement past the threshold.')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.threshold = app.config.get('METRICS_N_PLUS_ONE_THRESHOLD', 10)
+        app.extensions['metrics'] = self
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        path = app.config.get('METRICS_PATH', '/metrics')
+        if path:
+            app.add_url_rule(path, 'metrics', self.expose)
+
+    def _start_request(self):
+        request.environ['flask_metrics.started'] = time.perf_counter()
+
+    def _finish_request(self, response):
+        started = request.environ.pop('flask_metrics.started', None)
+        if started is None or request.endpoint == 'metrics':
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        stats = request_sql_stats()
+        statements = stats.statements
+
+        repeated = Counter()
+        for statement, count in statements.items():
+            repeated[normalize_statement(statement)] += count
+        worst = repeated.most_common(1)
+
+        with self._lock:
+            self.latency.observe(
+                (('endpoint', endpoint), ('method', request.method), ('status', response.status_code)), elapsed)
+            self.query_counts.observe((('endpoint', endpoint),), sum(statements.values()))
+            self.queries.inc((('endpoint', endpoint),), sum(statements.values()))
+            self.query_seconds.inc((('endpoint', endpoint),), stats.seconds)
+            if worst and worst[0][1] > self.threshold:
+                self.n_plus_one.inc((('endpoint', endpoint),))
+
+        if worst and worst[0][1] > self.threshold:
+            current_app.logger.warning(
+                'possible N+1 on %s: %d runs of %s', endpoint, worst[0][1], worst[0][0])
+        return response
+
+    def expose(self):
+        with self._lock:
+            lines = []
+            for metric in (self.latency, self.query_counts, self.queries, self.query_seconds, self.n_plus_one):
+                lines.extend(metric.expose())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
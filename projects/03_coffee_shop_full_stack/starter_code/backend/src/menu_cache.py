@@ -0,0 +1,51 @@
+import hashlib
+import threading
+
+
+'''
+MenuCache
+    per-process cache of the serialized drink listings
+    - every cached body is tagged with the menu version it was built from
+    - the version is kept in the database (MenuVersion), so a write handled by
+      any worker process makes the bodies cached by every worker stale
+    - each body carries a strong etag (sha1 of the body) for If-None-Match
+    callers read the version before querying and pass it to get() and put();
+    writers bump it after committing, so a body is never older than its version
+    at most maxsize bodies are kept, the oldest one is dropped first
+'''
+class MenuCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    '''
+    get(name, version)
+        @param name the listing and its page parameters (ex: 'drinks', 'drinks-detail')
+        @param version the current menu version
+        @return {'body', 'etag', 'version'} built from that version, or None
+    '''
+    def get(self, name, version):
+        entry = self._entries.get(name)
+        if entry is None or entry['version'] != version:
+            return None
+        return entry
+
+    '''
+    put(name, version, body)
+        @param version the menu version read before the body was built
+        @param body the serialized response body (string)
+        @return the entry
+    '''
+    def put(self, name, version, body):
+        entry = {
+            'body': body,
+            'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+            'version': version
+        }
+        with self._lock:
+            self._entries.pop(name, None)
+            while len(self._entries) >= self.maxsize:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[name] = entry
+        return entry
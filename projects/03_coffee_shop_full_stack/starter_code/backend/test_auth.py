@@ -0,0 +1,49 @@
+import unittest
+
+from src.auth.auth import AuthError, check_permissions
+from src.auth.permissions import any_of, all_of, compile_permissions, granted_permissions
+
+
+class PermissionsTestCase(unittest.TestCase):
+    """This class represents the permission checks of requires_auth"""
+
+    def allows(self, required, permissions):
+        return compile_permissions(required).allows(granted_permissions(permissions))
+
+    def test_exact_permission(self):
+        self.assertTrue(self.allows('post:drinks', ['get:drinks-detail', 'post:drinks']))
+        self.assertFalse(self.allows('post:drinks', ['get:drinks-detail']))
+
+    def test_granted_wildcards(self):
+        self.assertTrue(self.allows('post:drinks', ['post:*']))
+        self.assertTrue(self.allows('post:drinks', ['*:drinks']))
+        self.assertTrue(self.allows('post:drinks', ['*:*']))
+        self.assertFalse(self.allows('post:drinks', ['patch:*']))
+        self.assertFalse(self.allows('post:drinks', ['*:drinks-detail']))
+
+    def test_required_wildcard_needs_a_granted_wildcard(self):
+        self.assertFalse(self.allows('post:*', ['post:drinks']))
+        self.assertTrue(self.allows('post:*', ['post:*']))
+
+    def test_any_of_and_all_of(self):
+        self.assertTrue(self.allows(any_of('patch:drinks', 'delete:drinks'), ['delete:drinks']))
+        self.assertFalse(self.allows(any_of('patch:drinks', 'delete:drinks'), ['post:drinks']))
+        self.assertTrue(self.allows(all_of('patch:drinks', 'delete:drinks'), ['patch:*', 'delete:drinks']))
+        self.assertFalse(self.allows(all_of('patch:drinks', 'delete:drinks'), ['patch:drinks']))
+        self.assertTrue(self.allows(['get:drinks-detail', 'post:drinks'], ['*:*']))
+
+    def test_403_check_permissions_without_the_permission(self):
+        with self.assertRaises(AuthError) as raised:
+            check_permissions('delete:drinks', {'permissions': ['delete:images', 'post:*']})
+        self.assertEqual(raised.exception.status_code, 403)
+        self.assertTrue(check_permissions('delete:drinks', {'permissions': ['delete:*']}))
+
+    def test_400_check_permissions_without_permissions_claim(self):
+        with self.assertRaises(AuthError) as raised:
+            check_permissions('get:drinks-detail', {})
+        self.assertEqual(raised.exception.status_code, 400)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()